@@ -0,0 +1,250 @@
+"""End-to-end benchmark against local fake Smartsheet and Graph servers.
+
+    python bench/bench_e2e.py [--rows N] [--emails N] [--forms N] [--latency-ms MS] [--rate-429 P]
+                              [--mode stages|pipeline] [--record DIR --smartsheet-upstream URL --graph-upstream URL]
+                              [--replay DIR]
+
+`stages` drives each main_loop component in turn and reports per-stage throughput, latency
+and API calls. `pipeline` runs the asyncio Pipeline until every reply has been sent and
+reports end-to-end throughput. --record proxies real traffic to sanitized cassettes in DIR;
+--replay serves those cassettes back instead of synthetic data.
+"""
+import argparse, asyncio, json, logging, os, statistics, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_services import FakeSmartsheet, FakeGraph, RecordingProxy, ReplayServer
+
+DRIVE_ID = 'bench-drive'
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('--rows', type=int, default=2000, help='Smartsheet rows')
+    p.add_argument('--comments', type=float, default=1.0, help='average comments per row')
+    p.add_argument('--extra-columns', type=int, default=0, help='unread columns added to the sheet')
+    p.add_argument('--emails', type=int, default=200, help='unread PD emails')
+    p.add_argument('--forms', type=int, default=50, help='form rows')
+    p.add_argument('--latency-ms', type=float, default=20, help='injected latency per API call')
+    p.add_argument('--rate-429', type=float, default=0.01, help='fraction of calls answered with 429')
+    p.add_argument('--retry-after', type=int, default=1)
+    p.add_argument('--smartsheet-rate-limit', type=int, default=100000, help='client-side calls/minute')
+    p.add_argument('--mode', choices=('stages', 'pipeline'), default='stages')
+    p.add_argument('--timeout', type=float, default=300, help='pipeline mode: give up after this many seconds')
+    p.add_argument('--record', metavar='DIR', help='proxy to the upstreams and write cassettes to DIR')
+    p.add_argument('--smartsheet-upstream', default='https://api.smartsheet.com')
+    p.add_argument('--graph-upstream', default='https://graph.microsoft.com')
+    p.add_argument('--replay', metavar='DIR', help='serve cassettes recorded with --record')
+    p.add_argument('--json', action='store_true', help='print the report as JSON')
+    return p.parse_args()
+
+def start_services(args):
+    faults = {'latency': args.latency_ms / 1000.0, 'rate_429': args.rate_429, 'retry_after': args.retry_after}
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        return (RecordingProxy(args.smartsheet_upstream, os.path.join(args.record, 'smartsheet.jsonl')).start(),
+                RecordingProxy(args.graph_upstream, os.path.join(args.record, 'graph.jsonl')).start())
+    if args.replay:
+        return (ReplayServer(os.path.join(args.replay, 'smartsheet.jsonl'), **faults).start(),
+                ReplayServer(os.path.join(args.replay, 'graph.jsonl'), **faults).start())
+    return (FakeSmartsheet(rows=args.rows, comments_per_row=args.comments, extra_columns=args.extra_columns,
+                           **faults).start(),
+            FakeGraph(emails=args.emails, form_rows=args.forms, sheet_rows=args.rows, **faults).start())
+
+def configure(args, smartsheet, graph, workdir):
+    """Point purpledoc's config at the stand-ins. Must run before purpledoc is imported."""
+    os.chdir(workdir)
+    # The Smartsheet SDK logs every injected 429 at error level.
+    logging.getLogger('smartsheet').setLevel(logging.CRITICAL)
+    if not args.record:
+        expires = time.time() + 86400
+        with open('o365_token.txt', 'w') as f:
+            json.dump({'token_type': 'Bearer', 'scope': ['Mail.ReadWrite'], 'access_token': 'bench',
+                       'refresh_token': 'bench', 'expires_in': 86400, 'expires_at': expires}, f)
+        os.environ.update({'SMARTSHEET_TOKEN': 'bench', 'CLIENT_ID': 'bench'})
+        os.environ.pop('CLIENT_SECRET', None)
+    os.environ.update({
+        # The stand-ins and the recording proxy serve plain http, which oauthlib refuses unless told otherwise.
+        'OAUTHLIB_INSECURE_TRANSPORT': '1',
+        'SMARTSHEET_API_BASE': f'{smartsheet.url}/2.0',
+        'GRAPH_URL': f'{graph.url}/v1.0',
+        'SHEET_ID': str(getattr(smartsheet, 'sheet_id', os.getenv('SHEET_ID', 4242))),
+        'SMARTSHEET_RATE_LIMIT': str(args.smartsheet_rate_limit),
+        'O365_TOKEN_FILE': os.getenv('O365_TOKEN_FILE', 'o365_token.txt') if args.record else 'o365_token.txt',
+        'PDF_TEMPLATE': make_template(workdir),
+        'PDF_ARCHIVE_DIR': '',
+        'TECH_ROSTER': 'John Smith,Jane Doe,Alex Johnson,Maria Garcia,Sam Lee',
+        'SMARTSHEET_POLL_INTERVAL': '1', 'INBOX_POLL_INTERVAL': '0.2', 'FORM_POLL_INTERVAL': '0.2',
+        'SMARTSHEET_POLL_MAX_INTERVAL': '2', 'INBOX_POLL_MAX_INTERVAL': '1', 'FORM_POLL_MAX_INTERVAL': '1',
+    })
+
+def make_template(workdir):
+    """A one-page AcroForm with the fields purpledoc fills."""
+    from pdfrw import PdfWriter, PdfDict, PdfName, PdfString, PdfArray, IndirectPdfDict
+    fields = ['SERVICE TICKET', 'COMPANY', 'SITE NAME', 'REQUESTED BY', 'SITE ADDRESS', 'TICKET REQUESTRow1',
+              'TECHRow1', 'TECHNICIAN NOTESRow1', 'ADDITIONAL NOTESRow1', 'HOURSRow1', 'DATERow1']
+    annots = PdfArray()
+    for i, name in enumerate(fields):
+        annots.append(IndirectPdfDict(Type=PdfName.Annot, Subtype=PdfName.Widget, FT=PdfName.Tx,
+                                      T=PdfString.encode(name), Rect=PdfArray([50, 700 - i * 20, 400, 714 - i * 20])))
+    page = IndirectPdfDict(Type=PdfName.Page, MediaBox=PdfArray([0, 0, 612, 792]), Annots=annots,
+                           Contents=IndirectPdfDict(stream='BT /F1 12 Tf 72 740 Td (Purple Doc) Tj ET'))
+    writer = PdfWriter()
+    writer.addpage(page)
+    writer.trailer.Root.AcroForm = PdfDict(Fields=annots)
+    path = os.path.join(workdir, 'template.pdf')
+    writer.write(path)
+    return path
+
+class Report:
+    def __init__(self, services):
+        self.services = services
+        self.stages = []
+
+    def _calls(self):
+        return {f'{label}:{route}': n for label, svc in self.services.items() for route, n in svc.calls.items()}
+
+    def _throttled(self):
+        return sum(sum(svc.throttled.values()) for svc in self.services.values())
+
+    def stage(self, name, fn, items=None, per_item=None):
+        """Run fn() (or per_item(x) for each of items) and record its timing and API calls."""
+        before, throttled = self._calls(), self._throttled()
+        latencies = []
+        start = time.perf_counter()
+        if per_item is not None:
+            result = []
+            for item in items:
+                t = time.perf_counter()
+                result.append(per_item(item))
+                latencies.append(time.perf_counter() - t)
+        else:
+            result = fn()
+        elapsed = time.perf_counter() - start
+        after = self._calls()
+        count = len(items) if items is not None else (len(result) if hasattr(result, '__len__') else 1)
+        self.stages.append({
+            'stage': name, 'items': count, 'seconds': round(elapsed, 4),
+            'items_per_sec': round(count / elapsed, 1) if elapsed else None,
+            'p50_ms': round(statistics.median(latencies) * 1000, 3) if latencies else None,
+            'p95_ms': round(sorted(latencies)[int(len(latencies) * 0.95)] * 1000, 3) if latencies else None,
+            'api_calls': {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)},
+            'throttled': self._throttled() - throttled,
+        })
+        return result
+
+    def print(self, as_json=False):
+        if as_json:
+            print(json.dumps({'stages': self.stages, 'api_calls': self._calls()}, indent=2))
+            return
+        print(f"{'stage':<22}{'items':>7}{'seconds':>10}{'items/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'calls':>7}{'429s':>6}")
+        for s in self.stages:
+            print(f"{s['stage']:<22}{s['items']:>7}{s['seconds']:>10.3f}{s['items_per_sec'] or 0:>10.1f}"
+                  f"{s['p50_ms'] or 0:>9.2f}{s['p95_ms'] or 0:>9.2f}{sum(s['api_calls'].values()):>7}{s['throttled']:>6}")
+        print('\nAPI calls by route:')
+        for route, n in sorted(self._calls().items()):
+            print(f'  {route:<40}{n:>7}')
+
+def run_stages(args, report, smartsheet):
+    from purpledoc.cache import get_cache
+    from purpledoc.smartsheet_client import SmartsheetSync
+    from purpledoc.email_client import get_mail_client
+    from purpledoc.forms import get_form_reader
+    from purpledoc.parser import load_roster
+    from purpledoc.pdf_util import RenderPool
+    from purpledoc.jobs import parse_email, build_email_job, prepare_form_row, deliver
+    from purpledoc.config import PDF_TEMPLATE
+
+    cache = get_cache()
+    sync = SmartsheetSync()
+    report.stage('smartsheet full sync', lambda: sync.full_sync() and sync.rows)
+    report.stage('cache save (full)', lambda: sync.save(cache))
+    report.stage('smartsheet refresh', lambda: [sync.refresh()])
+    if hasattr(smartsheet, 'touch'):
+        smartsheet.touch()
+        report.stage('refresh after edits', lambda: [sync.refresh()])
+        report.stage('cache save (upsert)', lambda: sync.save(cache))
+
+    roster = load_roster()
+    client = get_mail_client()
+    msgs = report.stage('inbox poll', lambda: list(client.poll_pd_messages()))
+    parsed = report.stage('parse', None, msgs, lambda m: parse_email(m, roster))
+    pairs = list(zip(msgs, parsed))
+    jobs = report.stage('lookup (email)', None, pairs, lambda p: build_email_job(p[0], p[1], sync.index))
+    reader = get_form_reader(DRIVE_ID)
+    form_rows = report.stage('form poll', lambda: reader.get_rows())
+    form_jobs = report.stage('lookup (form)', None, form_rows, lambda r: prepare_form_row(r, sync.index))
+    report.stage('form poll (unchanged)', lambda: reader.get_rows())
+    jobs = [j for j in jobs + form_jobs if j]
+
+    pool = RenderPool()
+    try:
+        results = report.stage('render', lambda: pool.render_many([j['field_map'] for j in jobs], PDF_TEMPLATE))
+    finally:
+        pool.close()
+    rendered = [(j, pdf) for j, (pdf, error) in zip(jobs, results) if not error]
+    report.stage('send + mark read', lambda: deliver(rendered))
+
+def run_pipeline(args, report, smartsheet, graph):
+    from purpledoc.cache import get_cache
+    from purpledoc.smartsheet_client import SmartsheetSync
+    from purpledoc.parser import load_roster
+    from purpledoc.pdf_util import RenderPool
+    from purpledoc.tracker import ProcessedTracker
+    from purpledoc.pipeline import Pipeline
+    from purpledoc.metrics import REGISTRY
+
+    cache = get_cache()
+    sync = SmartsheetSync()
+    report.stage('smartsheet full sync', lambda: sync.full_sync() and sync.rows)
+    sync.save(cache)
+    known = {str(100000 + i) for i in range(args.rows)}
+    expected = args.emails + sum(1 for row in graph.form_values[1:] if row[3] in known)
+    pool = RenderPool()
+    pipeline = Pipeline(sync, cache, pool, ProcessedTracker(), roster=load_roster(), drive_id=DRIVE_ID)
+
+    async def until_done():
+        task = asyncio.ensure_future(pipeline.run())
+        deadline = time.monotonic() + args.timeout
+        while len(graph.sent) < expected and time.monotonic() < deadline and not task.done():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    started = time.monotonic()
+    report.stage('pipeline', lambda: asyncio.run(until_done()) or graph.sent)
+    pool.close()
+    latencies = sorted(s['at'] - started for s in graph.sent)
+    if latencies:
+        print(f'pipeline: {len(latencies)}/{expected} replies, '
+              f'{len(latencies) / (latencies[-1] or 1):.1f} replies/s, '
+              f'first {latencies[0]:.2f}s, p50 {latencies[len(latencies) // 2]:.2f}s, last {latencies[-1]:.2f}s')
+    print('stage timings from purpledoc.metrics:')
+    for entry in REGISTRY.snapshot()['purpledoc_stage_seconds']:
+        mean = entry['sum'] / entry['count'] * 1000 if entry['count'] else 0
+        print(f"  {entry['labels']['stage']:<18}{entry['count']:>6} calls{mean:>10.1f} ms mean")
+
+def main():
+    args = parse_args()
+    if args.mode == 'pipeline' and (args.record or args.replay):
+        sys.exit('--mode pipeline needs the synthetic servers')
+    smartsheet, graph = start_services(args)
+    workdir = tempfile.mkdtemp(prefix='purpledoc-bench-')
+    configure(args, smartsheet, graph, workdir)
+    report = Report({'smartsheet': smartsheet, 'graph': graph})
+    try:
+        if args.mode == 'stages':
+            run_stages(args, report, smartsheet)
+        else:
+            run_pipeline(args, report, smartsheet, graph)
+    finally:
+        smartsheet.stop()
+        graph.stop()
+    report.print(args.json)
+    print(f'\nworkdir: {workdir}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Email body parser throughput: python bench/bench_parser.py [bodies]"""
+import os, sys, time, random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from purpledoc.parser import parse_email_body
+
+def synthetic_bodies(n, seed=3):
+    rng = random.Random(seed)
+    bodies = []
+    for i in range(n):
+        bodies.append(
+            f"Ticket #{rng.randint(100000, 999999)}\n@John Smith\n"
+            f"Replaced the access point in room {i}.\nVerified connectivity and tested VoIP phones.\n"
+            f"Time: {rng.choice(['1.5', '2', '0:45'])}\n@Jane Doe\nRan cable to the new desk.\n1.25\nClosed\n\n"
+            "Thanks,\nJohn\nGet Outlook for iOS\n" + "> quoted history line\n" * rng.randint(0, 30)
+        )
+    return bodies
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bodies = synthetic_bodies(n)
+    best = 0.0
+    for _ in range(3):
+        start = time.perf_counter()
+        for body in bodies:
+            parse_email_body(body)
+        best = max(best, n / (time.perf_counter() - start))
+    print(f'parse_email_body: {best:,.0f} bodies/sec ({n} bodies, best of 3)')
+
+if __name__ == '__main__':
+    main()
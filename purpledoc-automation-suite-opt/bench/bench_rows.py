@@ -0,0 +1,83 @@
+"""In-memory Smartsheet row footprint: python bench/bench_rows.py [rows] [columns]
+
+Compares the original per-row dict of every column with column projection, as dicts and as
+compact purpledoc.rows.Row objects. Sheets are synthetic SDK-shaped objects, so the retained
+size covers the row containers and the cell values they keep alive once the sheet is dropped.
+"""
+import gc, os, pickle, sys, time, tracemalloc
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from purpledoc.cache import _dumps
+from purpledoc.smartsheet_client import _sheet_columns, _sheet_rows, row_schema
+
+BASE_COLUMNS = ['Ticket Number', 'Site', 'Requestor', 'Address', 'Problem', 'Status']
+
+def synthetic_sheet(n_rows, n_columns, projected=False):
+    titles = BASE_COLUMNS + [f'Notes {i}' for i in range(n_columns - len(BASE_COLUMNS))]
+    columns = [SimpleNamespace(id=9000 + i, title=t) for i, t in enumerate(titles)]
+    if projected:
+        # What get_sheet(column_ids=...) returns: only the projected columns and their cells.
+        keep = {c['id'] for c in _sheet_columns(SimpleNamespace(columns=columns))}
+        columns = [c for c in columns if c.id in keep]
+    rows = []
+    for r in range(n_rows):
+        cells = [SimpleNamespace(column_id=c.id, value=f'{c.title} value for row {r}') for c in columns]
+        rows.append(SimpleNamespace(id=7000000 + r, cells=cells))
+    return SimpleNamespace(columns=columns, rows=rows)
+
+def legacy_rows(sheet):
+    """The pre-projection row dicts, keyed by every lowercased column title."""
+    rows = []
+    for row in sheet.rows:
+        row_dict = {sheet.columns[i].title.lower(): cell.value for i, cell in enumerate(row.cells)}
+        row_dict['_row_id'] = row.id
+        rows.append(row_dict)
+    return rows
+
+def projected_dicts(sheet):
+    titles = {c.id: c.title.strip().lower() for c in sheet.columns}
+    rows = []
+    for row in sheet.rows:
+        row_dict = {titles[cell.column_id]: cell.value for cell in row.cells}
+        row_dict['_row_id'] = row.id
+        rows.append(row_dict)
+    return rows
+
+def compact_rows(sheet):
+    return list(_sheet_rows(sheet, row_schema(_sheet_columns(sheet))))
+
+def measure(build, n_rows, n_columns, projected):
+    gc.collect()
+    tracemalloc.start()
+    sheet = synthetic_sheet(n_rows, n_columns, projected)
+    start = time.perf_counter()
+    rows = build(sheet)
+    build_s = time.perf_counter() - start
+    del sheet
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    text = [_dumps(row) for row in rows]
+    json_s = time.perf_counter() - start
+    start = time.perf_counter()
+    blob = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle_s = time.perf_counter() - start
+    return retained, build_s, sum(map(len, text)), json_s, len(blob), pickle_s
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 12000
+    n_columns = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    print(f'{n_rows} rows x {n_columns} columns')
+    print(f'{"layout":<26}{"retained MB":>12}{"build ms":>10}{"json MB":>9}{"json ms":>9}{"pickle MB":>11}{"pickle ms":>11}')
+    baseline = None
+    for name, build, projected in [('dict, all columns', legacy_rows, False),
+                                   ('dict, projected', projected_dicts, True),
+                                   ('Row, projected', compact_rows, True)]:
+        retained, build_s, json_bytes, json_s, pickle_bytes, pickle_s = measure(build, n_rows, n_columns, projected)
+        baseline = baseline or retained
+        print(f'{name:<26}{retained / 1e6:>12.1f}{build_s * 1000:>10.0f}{json_bytes / 1e6:>9.1f}{json_s * 1000:>9.0f}'
+              f'{pickle_bytes / 1e6:>11.1f}{pickle_s * 1000:>11.0f}   ({retained / baseline:.0%})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Golden-corpus equivalence check for the email parser: python bench/check_parser_golden.py
+
+bench/parser_golden.json holds email bodies with the outputs of the original parser
+(parse_email_body, strip_signature, html_to_clean_text), plus @mention resolution against a
+fixed roster. Current outputs must match exactly.
+Exits non-zero and prints each difference on any drift.
+"""
+import json, os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from purpledoc.parser import BR_RE, TechRoster, html_to_clean_text, parse_email_body, strip_signature
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser_golden.json')
+
+def _plain(parsed):
+    parsed = dict(parsed)
+    parsed['techs'] = {k: dict(v) for k, v in parsed['techs'].items()}
+    return parsed
+
+def check(golden):
+    failures = []
+    def expect(name, what, actual, expected):
+        if actual != expected:
+            failures.append(f'{name} {what}:\n  expected {expected!r}\n  actual   {actual!r}')
+    for case in golden['text']:
+        expect(case['name'], 'parse_email_body', _plain(parse_email_body(case['body'])), case['parsed'])
+        # Streamed message bodies arrive as lines (split on <br>, as iter_email_lines does).
+        lines = iter(BR_RE.sub('\n', case['body']).splitlines())
+        expect(case['name'], 'parse_email_body(lines)', _plain(parse_email_body(lines)), case['parsed'])
+        expect(case['name'], 'strip_signature', strip_signature(case['body']), case['stripped'])
+    for case in golden['html']:
+        text = html_to_clean_text(case['html'])
+        expect(case['name'], 'html_to_clean_text', text, case['text'])
+        expect(case['name'], 'parse_email_body', _plain(parse_email_body(text)), case['parsed'])
+    spec = golden['roster']
+    roster = TechRoster(spec['names'], threshold=spec['threshold'], min_length=spec['min_length'])
+    for case in spec['mentions']:
+        expect(f"@{case['mention']}", 'TechRoster.resolve', roster.resolve(case['mention']), case['resolved'])
+    for case in spec['bodies']:
+        expect(case['name'], 'parse_email_body(roster)', _plain(parse_email_body(case['body'], roster=roster)),
+               case['parsed'])
+    return failures
+
+def main():
+    with open(GOLDEN, encoding='utf-8') as f:
+        golden = json.load(f)
+    failures = check(golden)
+    total = 3 * len(golden['text']) + 2 * len(golden['html']) + len(golden['roster']['mentions']) \
+        + len(golden['roster']['bodies'])
+    for failure in failures:
+        print(failure)
+    print(f'{total - len(failures)}/{total} golden checks passed')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
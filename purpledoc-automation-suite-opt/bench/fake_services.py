@@ -0,0 +1,448 @@
+"""Local stand-ins for the Smartsheet and Microsoft Graph endpoints purpledoc calls.
+
+Both servers are seeded with synthetic data, count every call by route, and can inject
+latency and 429s. A RecordingProxy captures sanitized real traffic to a JSONL cassette,
+and a ReplayServer serves it back, so a regression run can replay a real session.
+"""
+import json, random, re, threading, time, urllib.parse, urllib.request, urllib.error
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SHEET_COLUMNS = ['Ticket Number', 'Site', 'Requestor', 'Address', 'Problem', 'Status']
+FORM_HEADER = ['ID', 'Email', 'Name', 'Ticket Number', 'Work Done', 'Time Spent', 'Ticket Status', 'Completion Time']
+TECHS = ['John Smith', 'Jane Doe', 'Alex Johnson', 'Maria Garcia', 'Sam Lee']
+
+def _iso(dt):
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def ticket_number(i):
+    return str(100000 + i)
+
+def email_body(rng, ticket):
+    tech = rng.choice(TECHS)
+    return (f"Ticket #{ticket}\n@{tech}\nReplaced the access point and verified connectivity.\n"
+            f"Time: {rng.choice(['1.5', '2', '0:45'])}\nClosed\n\nThanks,\n{tech.split()[0]}\n"
+            + "> quoted history line\n" * rng.randint(0, 20))
+
+class FakeService(ThreadingHTTPServer):
+    """ThreadingHTTPServer that routes to handler methods and tracks call counts."""
+
+    daemon_threads = True
+    routes = []
+
+    def __init__(self, latency=0.0, rate_429=0.0, retry_after=1, seed=7):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.lock = threading.RLock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def should_throttle(self):
+        with self.lock:
+            return self.rate_429 > 0 and self.rng.random() < self.rate_429
+
+    def dispatch(self, method, path, query, body, headers=None, nested=False):
+        """Return (status, headers, payload) for one request, counting it by route name.
+
+        Requests inside a $batch are counted as '$batch/<route>', apart from HTTP round trips.
+        """
+        for route_method, pattern, name in self.routes:
+            m = pattern.match(path)
+            if route_method == method and m:
+                with self.lock:
+                    self.calls['$batch/' + name if nested else name] += 1
+                if self.should_throttle():
+                    with self.lock:
+                        self.throttled[name] += 1
+                    return 429, {'Retry-After': str(self.retry_after)}, self.throttle_body()
+                return getattr(self, name)(query, body, *m.groups())
+        with self.lock:
+            self.calls[f'unrouted {method} {path}'] += 1
+        return 404, {}, {'error': {'code': 'NotFound', 'message': path}}
+
+    def throttle_body(self):
+        return {'error': {'code': 'TooManyRequests', 'message': 'Rate limit exceeded.'}}
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        body = json.loads(raw) if raw else None
+        parsed = urllib.parse.urlsplit(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status, headers, payload = self.server.dispatch(self.command, urllib.parse.unquote(parsed.path), query, body,
+                                                       dict(self.headers))
+        data = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _handle
+
+def _route(method, pattern, name):
+    return method, re.compile(pattern + '$'), name
+
+class FakeSmartsheet(FakeService):
+    """Sheet, sheet version, and row/sheet discussion endpoints of the Smartsheet 2.0 API."""
+
+    routes = [
+        _route('GET', r'/2\.0/sheets/(\d+)/version', 'sheet_version'),
+        _route('GET', r'/2\.0/sheets/(\d+)/columns', 'get_columns'),
+        _route('GET', r'/2\.0/sheets/(\d+)/rows/(\d+)/discussions', 'row_discussions'),
+        _route('GET', r'/2\.0/sheets/(\d+)/discussions', 'sheet_discussions'),
+        _route('GET', r'/2\.0/sheets/(\d+)', 'get_sheet'),
+    ]
+
+    def __init__(self, rows=1000, comments_per_row=1.0, sheet_id=4242, extra_columns=0, **kwargs):
+        super().__init__(**kwargs)
+        self.sheet_id = sheet_id
+        self.version = 1
+        # extra_columns widens the sheet with note columns purpledoc never reads.
+        titles = SHEET_COLUMNS + [f'Notes {i + 1}' for i in range(extra_columns)]
+        self.columns = [{'id': 9000 + i, 'index': i, 'title': t, 'type': 'TEXT_NUMBER'} for i, t in enumerate(titles)]
+        self.rows = {}
+        self.discussions = defaultdict(list)
+        self._next_id = 1
+        created = _now() - timedelta(days=30)
+        for i in range(rows):
+            row_id = self._add_row(i, created)
+            for _ in range(int(comments_per_row) + (self.rng.random() < comments_per_row % 1)):
+                self._add_comment(row_id, created)
+
+    def _add_row(self, i, modified=None):
+        row_id = 7000000 + i
+        site = f'Site {i % 97}'
+        self.rows[row_id] = {
+            'id': row_id, 'rowNumber': len(self.rows) + 1, 'modifiedAt': _iso(modified or _now()),
+            'values': [ticket_number(i), site, f'Requestor {i % 13}', f'{i} Main St', f'Problem report {i}', 'Open']
+                      + [f'Note {j} for row {i}' for j in range(len(self.columns) - len(SHEET_COLUMNS))],
+        }
+        return row_id
+
+    def _add_comment(self, row_id, at=None):
+        at = at or _now()
+        self._next_id += 1
+        comment = {'id': self._next_id, 'text': f'Update {self._next_id}', 'createdAt': _iso(at),
+                   'createdBy': {'email': 'dispatch@example.com', 'name': 'Dispatch'}}
+        threads = self.discussions[row_id]
+        if not threads:
+            threads.append({'id': row_id * 10, 'parentId': row_id, 'parentType': 'ROW', 'comments': []})
+        threads[0]['comments'].append(comment)
+        threads[0]['lastCommentedAt'] = _iso(at)
+
+    def touch(self, fraction=0.01, comments=0.01):
+        """Modify a fraction of rows and comment on a fraction, bumping the sheet version."""
+        with self.lock:
+            ids = list(self.rows)
+            for row_id in self.rng.sample(ids, max(1, int(len(ids) * fraction))):
+                self.rows[row_id]['values'][len(SHEET_COLUMNS) - 1] = self.rng.choice(['Open', 'In Progress', 'Closed'])
+                self.rows[row_id]['modifiedAt'] = _iso(_now())
+            for row_id in self.rng.sample(ids, int(len(ids) * comments)):
+                self._add_comment(row_id)
+            self.version += 1
+
+    def _row_json(self, row, column_ids=None):
+        cells = [{'columnId': c['id'], 'value': v} for c, v in zip(self.columns, row['values'])
+                 if column_ids is None or c['id'] in column_ids]
+        return {'id': row['id'], 'rowNumber': row['rowNumber'], 'modifiedAt': row['modifiedAt'], 'cells': cells}
+
+    def get_sheet(self, query, body, sheet_id):
+        column_ids = {int(c) for c in query['columnIds'].split(',')} if query.get('columnIds') else None
+        since = datetime.fromisoformat(query['rowsModifiedSince']) if query.get('rowsModifiedSince') else None
+        with self.lock:
+            rows = [r for r in self.rows.values()
+                    if since is None or datetime.fromisoformat(r['modifiedAt']) >= since]
+            return 200, {}, {
+                'id': int(sheet_id), 'name': 'Tickets', 'version': self.version, 'totalRowCount': len(self.rows),
+                'columns': [c for c in self.columns if column_ids is None or c['id'] in column_ids],
+                'rows': [self._row_json(r, column_ids) for r in rows],
+            }
+
+    def get_columns(self, query, body, sheet_id):
+        return 200, {}, self._page(self.columns)
+
+    def sheet_version(self, query, body, sheet_id):
+        return 200, {}, {'version': self.version}
+
+    def _page(self, data):
+        return {'pageNumber': 1, 'pageSize': len(data), 'totalPages': 1, 'totalCount': len(data), 'data': data}
+
+    def row_discussions(self, query, body, sheet_id, row_id):
+        with self.lock:
+            return 200, {}, self._page(json.loads(json.dumps(self.discussions.get(int(row_id), []))))
+
+    def sheet_discussions(self, query, body, sheet_id):
+        comments = 'comments' in (query.get('include') or '')
+        with self.lock:
+            data = json.loads(json.dumps([d if comments else {k: v for k, v in d.items() if k != 'comments'}
+                                          for threads in self.discussions.values() for d in threads]))
+        return 200, {}, self._page(data)
+
+    def throttle_body(self):
+        return {'errorCode': 4003, 'message': 'Rate limit exceeded.', 'refId': 'bench'}
+
+class FakeGraph(FakeService):
+    """Inbox query/delta, mark-as-read, sendMail and $batch, plus the drive/workbook reads."""
+
+    routes = [
+        _route('POST', r'/v1\.0/\$batch', 'batch'),
+        _route('GET', r'/v1\.0/me/mailFolders/([^/]+)/messages/delta', 'messages_delta'),
+        _route('GET', r'/v1\.0/me/mailFolders/([^/]+)/messages', 'list_messages'),
+        _route('PATCH', r'/v1\.0/me/messages/([^/]+)', 'update_message'),
+        _route('POST', r'/v1\.0/me/sendMail', 'send_mail'),
+        _route('GET', r'/v1\.0/drives/([^/]+)/root:/(.+)', 'drive_item_by_path'),
+        _route('GET', r"/v1\.0/drives/([^/]+)/items/([^/]+)/workbook/worksheets\('([^']+)'\)/usedRange\(valuesOnly=true\)", 'used_range'),
+        _route('GET', r"/v1\.0/drives/([^/]+)/items/([^/]+)/workbook/worksheets\('([^']+)'\)/range\(address='([^']+)'\)", 'range'),
+        _route('GET', r'/v1\.0/drives/([^/]+)/items/([^/]+)/workbook/worksheets', 'worksheets'),
+        _route('GET', r'/v1\.0/drives/([^/]+)/items/([^/]+)', 'drive_item'),
+    ]
+
+    def __init__(self, emails=100, form_rows=20, sheet_rows=1000, bad_ticket_rate=0.05,
+                 form_filename='Purple Doc _Online Form.xlsx', **kwargs):
+        super().__init__(**kwargs)
+        self.messages = {}
+        self.sent = []
+        self.first_sent_at = None
+        self.last_sent_at = None
+        self._seq = 0
+        self.form_filename = form_filename
+        self.form_values = [FORM_HEADER]
+        self.etag_version = 1
+        self.sheet_rows = sheet_rows
+        self.bad_ticket_rate = bad_ticket_rate
+        for _ in range(emails):
+            self.add_email()
+        for _ in range(form_rows):
+            self.add_form_row()
+
+    def _ticket(self):
+        if self.rng.random() < self.bad_ticket_rate:
+            return str(900000 + self.rng.randint(0, 99999))
+        return ticket_number(self.rng.randrange(self.sheet_rows))
+
+    def add_email(self, subject='PD'):
+        with self.lock:
+            self._seq += 1
+            msg_id = f'AAMk{self._seq:08d}'
+            tech = self.rng.choice(TECHS)
+            address = tech.lower().replace(' ', '.') + '@example.com'
+            self.messages[msg_id] = {
+                'id': msg_id, 'subject': subject, 'isRead': False, '_seq': self._seq,
+                'receivedDateTime': _iso(_now()),
+                'from': {'emailAddress': {'address': address, 'name': tech}},
+                'sender': {'emailAddress': {'address': address, 'name': tech}},
+                'body': {'contentType': 'text', 'content': email_body(self.rng, self._ticket())},
+            }
+            return msg_id
+
+    def add_form_row(self):
+        with self.lock:
+            n = len(self.form_values)
+            tech = self.rng.choice(TECHS)
+            self.form_values.append([str(n), tech.lower().replace(' ', '.') + '@example.com', tech, self._ticket(),
+                                     'Swapped the switch and tested uplinks.', '1.5', 'closed', '10/16/2026 14:05:00'])
+            self.etag_version += 1
+
+    # Mail
+
+    def _public(self, msg):
+        return {k: v for k, v in msg.items() if not k.startswith('_')}
+
+    def _unread_pd(self):
+        return [m for m in self.messages.values() if not m['isRead'] and m['subject'] == 'PD']
+
+    def _paged(self, items, query, path):
+        top = int(query.get('$top') or 50)
+        skip = int(query.get('$skip') or 0)
+        data = {'value': [self._public(m) for m in items[skip:skip + top]]}
+        if skip + top < len(items):
+            data['@odata.nextLink'] = f'{self.url}{path}?' + urllib.parse.urlencode({**query, '$skip': skip + top})
+        return data
+
+    def list_messages(self, query, body, folder):
+        with self.lock:
+            return 200, {}, self._paged(self._unread_pd(), query, f'/v1.0/me/mailFolders/{folder}/messages')
+
+    def messages_delta(self, query, body, folder):
+        since = int(query.get('$deltatoken') or 0)
+        skip = int(query.get('$skiptoken') or 0)
+        page = 50
+        with self.lock:
+            changed = [m for m in self.messages.values() if m['_seq'] > since]
+            data = {'value': [self._public(m) for m in changed[skip:skip + page]]}
+            path = f'{self.url}/v1.0/me/mailFolders/{folder}/messages/delta?'
+            if skip + page < len(changed):
+                data['@odata.nextLink'] = path + urllib.parse.urlencode({'$deltatoken': since, '$skiptoken': skip + page})
+            else:
+                data['@odata.deltaLink'] = path + urllib.parse.urlencode({'$deltatoken': self._seq})
+        return 200, {}, data
+
+    def update_message(self, query, body, msg_id):
+        with self.lock:
+            msg = self.messages.get(msg_id)
+            if msg is None:
+                return 404, {}, {'error': {'code': 'ErrorItemNotFound'}}
+            msg.update({k: v for k, v in (body or {}).items() if k in ('isRead',)})
+            self._seq += 1
+            msg['_seq'] = self._seq
+            return 200, {}, self._public(msg)
+
+    def send_mail(self, query, body, *groups):
+        with self.lock:
+            now = time.monotonic()
+            self.first_sent_at = self.first_sent_at or now
+            self.last_sent_at = now
+            message = (body or {}).get('message', {})
+            self.sent.append({'to': [r['emailAddress']['address'] for r in message.get('toRecipients', [])],
+                              'subject': message.get('subject'), 'attachments': len(message.get('attachments', [])),
+                              'at': now})
+        return 202, {}, None
+
+    def batch(self, query, body, *groups):
+        responses, status_of = [], {}
+        for req in (body or {}).get('requests', []):
+            if any(status_of.get(dep, 500) >= 300 for dep in req.get('dependsOn', [])):
+                status, headers, payload = 424, {}, {'error': {'code': 'FailedDependency'}}
+            else:
+                parsed = urllib.parse.urlsplit(req['url'])
+                sub_query = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+                status, headers, payload = self.dispatch(req['method'], '/v1.0' + parsed.path, sub_query, req.get('body'),
+                                                        nested=True)
+            status_of[req['id']] = status
+            responses.append({'id': req['id'], 'status': status, 'headers': headers, 'body': payload})
+        return 200, {}, {'responses': responses}
+
+    # Drive / workbook
+
+    def _etag(self):
+        return f'"{{BENCH}},{self.etag_version}"'
+
+    def drive_item_by_path(self, query, body, drive_id, path):
+        if path != self.form_filename:
+            return 404, {}, {'error': {'code': 'itemNotFound'}}
+        return 200, {}, {'id': 'FORMITEM', 'name': path, 'eTag': self._etag()}
+
+    def drive_item(self, query, body, drive_id, item_id):
+        return 200, {}, {'id': item_id, 'eTag': self._etag()}
+
+    def worksheets(self, query, body, drive_id, item_id):
+        return 200, {}, {'value': [{'name': 'Sheet1', 'position': 0}]}
+
+    def _address(self, last_row):
+        return f"Sheet1!A1:{chr(ord('A') + len(FORM_HEADER) - 1)}{last_row}"
+
+    def used_range(self, query, body, drive_id, item_id, sheet):
+        with self.lock:
+            data = {'address': self._address(len(self.form_values))}
+            if query.get('$select') != 'address':
+                data['values'] = [list(r) for r in self.form_values]
+        return 200, {}, data
+
+    def range(self, query, body, drive_id, item_id, sheet, address):
+        m = re.match(r'[A-Z]+(\d+):[A-Z]+(\d+)$', address)
+        first, last = int(m.group(1)), int(m.group(2))
+        with self.lock:
+            return 200, {}, {'address': f'Sheet1!{address}', 'values': [list(r) for r in self.form_values[first - 1:last]]}
+
+# Record / replay
+
+_EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+_BASE = '{base}'
+_SECRET_KEYS = {'access_token', 'refresh_token', 'secret', 'contentBytes'}
+
+def sanitize(obj, emails=None):
+    """Mask e-mail addresses and drop secrets and attachment bytes, mapping each address consistently."""
+    emails = {} if emails is None else emails
+    if isinstance(obj, dict):
+        return {k: ('<redacted>' if k in _SECRET_KEYS else sanitize(v, emails)) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [sanitize(v, emails) for v in obj]
+    if isinstance(obj, str):
+        return _EMAIL_RE.sub(lambda m: emails.setdefault(m.group(0), f'user{len(emails) + 1}@example.com'), obj)
+    return obj
+
+class RecordingProxy(FakeService):
+    """Forwards every request to upstream and appends a sanitized copy of the exchange to a cassette."""
+
+    def __init__(self, upstream, cassette_path, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream = upstream.rstrip('/')
+        self.cassette_path = cassette_path
+        self.emails = {}
+
+    def dispatch(self, method, path, query, body, headers=None):
+        # The handler unquoted the path (e.g. the form workbook name); quote it again for the upstream.
+        url = self.upstream + urllib.parse.quote(path, safe="/:$'()!,;=@") + ('?' + urllib.parse.urlencode(query) if query else '')
+        req = urllib.request.Request(url, method=method, data=json.dumps(body).encode() if body is not None else None,
+                                     headers={k: v for k, v in (headers or {}).items() if k.lower() in ('authorization', 'prefer')}
+                                     | {'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req) as res:
+                status, raw, res_headers = res.status, res.read(), dict(res.headers)
+        except urllib.error.HTTPError as exc:
+            status, raw, res_headers = exc.code, exc.read(), dict(exc.headers)
+        # Keep paging links (@odata.nextLink etc.) pointed at the proxy, and base-relative on tape.
+        raw = raw.decode('utf-8').replace(self.upstream, self.url) if raw else ''
+        payload = json.loads(raw) if raw else None
+        with self.lock:
+            self.calls[f'{method} {path}'] += 1
+            with open(self.cassette_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'method': method, 'path': path, 'query': sanitize(query, self.emails),
+                                    'status': status,
+                                    'body': json.loads(json.dumps(sanitize(payload, self.emails)).replace(self.url, _BASE))}) + '\n')
+        keep = {k: v for k, v in res_headers.items() if k.lower() == 'retry-after'}
+        return status, keep, payload
+
+class ReplayServer(FakeService):
+    """Serves cassette responses in recorded order for each (method, path)."""
+
+    def __init__(self, cassette_path, **kwargs):
+        super().__init__(**kwargs)
+        self.tapes = defaultdict(deque)
+        with open(cassette_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.tapes[(entry['method'], entry['path'])].append(entry)
+
+    def dispatch(self, method, path, query, body, headers=None):
+        with self.lock:
+            self.calls[f'{method} {path}'] += 1
+            tape = self.tapes.get((method, path))
+            if not tape:
+                return 404, {}, {'error': {'code': 'NotRecorded', 'message': f'{method} {path}'}}
+            # The last recorded response keeps answering once a tape runs out.
+            entry = tape.popleft() if len(tape) > 1 else tape[0]
+        body = json.loads(json.dumps(entry['body']).replace(_BASE, self.url))
+        return entry['status'], {}, body
@@ -0,0 +1,144 @@
+import os, json, time, tempfile
+from collections.abc import Mapping
+from .config import SMARTSHEET_CACHE_BACKEND, SMARTSHEET_CACHE_DB, SMARTSHEET_CACHE_FILE
+from .rows import Row
+
+def _json_default(obj):
+    # Compact rows are stored as plain dicts, as before.
+    if isinstance(obj, Row):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+def atomic_write(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class JsonCache:
+    """The original smartsheet_cache.json layout. Every save rewrites the whole file."""
+
+    supports_upsert = False
+
+    def __init__(self, path=SMARTSHEET_CACHE_FILE, indent=2):
+        self.path = path
+        self.indent = indent
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save(self, columns, rows, conversations, version=None, synced_at=None, projection=None):
+        atomic_write(self.path, json.dumps({
+            'columns': columns,
+            'rows': rows,
+            'conversations': conversations,
+            'version': version,
+            'synced_at': synced_at,
+            'projection': projection,
+            'timestamp': int(time.time())
+        }, ensure_ascii=False, indent=self.indent, default=_json_default))
+
+class SqliteCache:
+    """Rows, comments and sync metadata in SQLite, so a changed row costs one upsert."""
+
+    supports_upsert = True
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS rows (row_id INTEGER PRIMARY KEY, seq INTEGER NOT NULL, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS comments (row_id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT);
+    '''
+
+    def __init__(self, path=SMARTSHEET_CACHE_DB):
+        self.path = path
+        import sqlite3
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM metadata LIMIT 1').fetchone() is None
+
+    def load(self):
+        if self.is_empty():
+            return {}
+        meta = {k: json.loads(v) for k, v in self.conn.execute('SELECT key, value FROM metadata')}
+        meta['rows'] = [json.loads(d) for (d,) in self.conn.execute('SELECT data FROM rows ORDER BY seq')]
+        meta['conversations'] = {
+            str(row_id): json.loads(d) for row_id, d in self.conn.execute('SELECT row_id, data FROM comments')
+        }
+        return meta
+
+    def _write_meta(self, columns, version, synced_at, projection):
+        self.conn.executemany('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)', [
+            ('columns', _dumps(columns)),
+            ('version', _dumps(version)),
+            ('synced_at', _dumps(synced_at)),
+            ('projection', _dumps(projection)),
+            ('timestamp', _dumps(int(time.time()))),
+        ])
+
+    def save(self, columns, rows, conversations, version=None, synced_at=None, projection=None):
+        with self.conn:
+            self.conn.execute('DELETE FROM rows')
+            self.conn.execute('DELETE FROM comments')
+            self.conn.executemany('INSERT INTO rows (row_id, seq, data) VALUES (?, ?, ?)',
+                                  [(row['_row_id'], seq, _dumps(row)) for seq, row in enumerate(rows)])
+            self.conn.executemany('INSERT INTO comments (row_id, data) VALUES (?, ?)',
+                                  [(int(row_id), _dumps(c)) for row_id, c in conversations.items()])
+            self._write_meta(columns, version, synced_at, projection)
+
+    def upsert(self, columns, rows, conversations, deleted_ids=(), version=None, synced_at=None, projection=None):
+        with self.conn:
+            next_seq = self.conn.execute('SELECT COALESCE(MAX(seq), -1) + 1 FROM rows').fetchone()[0]
+            self.conn.executemany(
+                'INSERT INTO rows (row_id, seq, data) VALUES (?, ?, ?) '
+                'ON CONFLICT(row_id) DO UPDATE SET data = excluded.data',
+                [(row['_row_id'], next_seq + i, _dumps(row)) for i, row in enumerate(rows)])
+            self.conn.executemany('INSERT OR REPLACE INTO comments (row_id, data) VALUES (?, ?)',
+                                  [(int(row_id), _dumps(c)) for row_id, c in conversations.items()])
+            self.conn.executemany('DELETE FROM rows WHERE row_id = ?', [(int(i),) for i in deleted_ids])
+            self.conn.executemany('DELETE FROM comments WHERE row_id = ?', [(int(i),) for i in deleted_ids])
+            self._write_meta(columns, version, synced_at, projection)
+
+def export_json(cache, path=SMARTSHEET_CACHE_FILE):
+    data = cache.load()
+    JsonCache(path).save(data.get('columns', []), data.get('rows', []), data.get('conversations', {}),
+                         data.get('version'), data.get('synced_at'), data.get('projection'))
+
+def get_cache(backend=SMARTSHEET_CACHE_BACKEND):
+    if backend == 'json':
+        return JsonCache()
+    if backend != 'sqlite':
+        raise ValueError(f'Unknown cache backend: {backend}')
+    cache = SqliteCache()
+    if cache.is_empty() and os.path.exists(SMARTSHEET_CACHE_FILE):
+        # One-time migration from the legacy JSON cache.
+        data = JsonCache().load()
+        if data.get('rows'):
+            cache.save(data.get('columns', []), data['rows'], data.get('conversations', {}),
+                       data.get('version'), data.get('synced_at'), data.get('projection'))
+    return cache
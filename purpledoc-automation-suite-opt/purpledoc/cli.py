@@ -0,0 +1,179 @@
+"""Command line entry point. Each subcommand imports only the modules it needs, so a
+one-shot `parse` or `render` doesn't load the Smartsheet SDK, O365 or asyncio."""
+import argparse, json, os, sys
+from .config import PDF_TEMPLATE, PROFILE_ENABLED, PROFILE_DIR, PROFILE_EVERY, PROFILE_SLOW_CYCLE
+
+COMMANDS = ('run', 'sync', 'render', 'parse', 'backfill')
+
+def _read_input(path):
+    if path == '-':
+        return sys.stdin.read()
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def _load_sync(refresh=True):
+    from .cache import get_cache
+    from .smartsheet_client import SmartsheetSync
+    cache = get_cache()
+    sync = SmartsheetSync.from_cache(cache)
+    if refresh or not sync.rows:
+        sync.refresh()
+        sync.save(cache)
+    return sync
+
+def main_loop(drive_id=None, profiler=None):
+    import asyncio
+    from . import metrics
+    from .parser import load_roster
+    from .pdf_util import RenderPool
+    from .pipeline import Pipeline
+    from .tracker import ProcessedTracker
+    from .cache import get_cache
+    from .smartsheet_client import SmartsheetSync
+    metrics.serve()
+    metrics.start_dumper()
+    cache = get_cache()
+    sync = SmartsheetSync.from_cache(cache)
+    if not sync.rows:
+        sync.full_sync()
+        sync.save(cache)
+    pipeline = Pipeline(sync, cache, RenderPool(), ProcessedTracker(), roster=load_roster(), drive_id=drive_id,
+                        profiler=profiler)
+    asyncio.run(pipeline.run())
+
+def cmd_run(args):
+    from .profiling import CycleProfiler
+    profiler = CycleProfiler(enabled=args.profile, out_dir=args.profile_dir, every=args.profile_every,
+                             slow=args.profile_slow)
+    main_loop(args.drive_id, profiler)
+
+def cmd_sync(args):
+    from .cache import get_cache
+    from .smartsheet_client import SmartsheetSync
+    cache = get_cache()
+    sync = SmartsheetSync.from_cache(cache)
+    changed = sync.full_sync() if args.full else sync.refresh()
+    sync.save(cache)
+    print(f'{len(sync.index)} tickets, {len(sync.conversations)} conversations'
+          f'{"" if changed else " (no changes)"}, synced at {sync.synced_at}')
+
+def cmd_render(args):
+    from .pdf_util import render_pdf
+    field_map = json.loads(_read_input(args.fields))
+    pdf_bytes = render_pdf(args.template, field_map)
+    if args.output == '-':
+        sys.stdout.buffer.write(pdf_bytes)
+    else:
+        with open(args.output, 'wb') as f:
+            f.write(pdf_bytes)
+        print(f'Wrote {len(pdf_bytes)} bytes to {args.output}')
+
+def cmd_parse(args):
+    from .parser import iter_html_lines, load_roster, parse_email_body
+    body = _read_input(args.file)
+    if args.html:
+        body = iter_html_lines(body)
+    parsed = parse_email_body(body, roster=None if args.no_roster else load_roster())
+    print(json.dumps(parsed, indent=2))
+
+def cmd_backfill(args):
+    """One pass over unread PD emails and unprocessed form rows, then exit."""
+    from .jobs import parse_email, build_email_job, prepare_form_row, render_and_send, flush_mail
+    sync = _load_sync(refresh=not args.no_refresh)
+    jobs, processed = [], None
+    if not args.no_email:
+        from .email_client import get_mail_client
+        from .parser import load_roster
+        roster = load_roster()
+        # The full unread query, which leaves the pipeline's delta link where it is.
+        for msg in get_mail_client().fetch_unread_pd_messages():
+            parsed = parse_email(msg, roster)
+            if args.dry_run:
+                found = parsed.get('ticket') and sync.index.get(parsed['ticket'])
+                print(f'email {msg.subject!r}: ticket {parsed.get("ticket")}, {"found" if found else "not found"}')
+                continue
+            job = build_email_job(msg, parsed, sync.index)
+            if job is not None:
+                jobs.append(job)
+    if args.drive_id and not args.no_forms:
+        from .forms import get_form_reader
+        from .tracker import ProcessedTracker
+        processed = ProcessedTracker()
+        for fr in get_form_reader(args.drive_id).get_rows(full=True):
+            rid = str(fr.get('id', '')).strip()
+            if not rid or rid in processed:
+                continue
+            job = prepare_form_row(fr, sync.index)
+            if job is None:
+                continue
+            if args.dry_run:
+                print(f'form row {rid}: ticket {job["ticket"]} -> {job["to"]}')
+                continue
+            job['form_id'] = rid
+            jobs.append(job)
+    if args.dry_run:
+        return
+    delivered = []
+    if jobs:
+        from .pdf_util import RenderPool
+        pool = RenderPool()
+        try:
+            delivered = render_and_send(jobs, pool)
+        finally:
+            pool.close()
+    else:
+        # Error replies queued while building email jobs.
+        flush_mail()
+    if processed is not None:
+        processed.add_many([job['form_id'] for job in delivered if job.get('form_id')])
+        processed.close()
+    print(f'Delivered {len(delivered)} of {len(jobs)} report(s).')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='purpledoc', description='PurpleDoc automation')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    drive_id = os.getenv('ONEDRIVE_DRIVE_ID')
+
+    run = commands.add_parser('run', help='run the polling pipeline (default)')
+    run.add_argument('--drive-id', default=drive_id, help='OneDrive drive holding the form workbook')
+    run.add_argument('--profile', action='store_true', default=PROFILE_ENABLED,
+                     help='capture cProfile/tracemalloc reports for selected cycles (env PROFILE=1)')
+    run.add_argument('--profile-dir', default=PROFILE_DIR, help='where .pstats and allocation reports go')
+    run.add_argument('--profile-every', type=int, default=PROFILE_EVERY,
+                     help='capture every Nth cycle of each stage/source (0: only after slow cycles)')
+    run.add_argument('--profile-slow', type=float, default=PROFILE_SLOW_CYCLE,
+                     help='seconds after which a cycle is slow and its next run is captured')
+    run.set_defaults(func=cmd_run)
+
+    sync = commands.add_parser('sync', help='refresh the Smartsheet cache once')
+    sync.add_argument('--full', action='store_true', help='re-download the whole sheet')
+    sync.set_defaults(func=cmd_sync)
+
+    render = commands.add_parser('render', help='fill the PDF template from a JSON field map')
+    render.add_argument('fields', help="JSON file of form field values, or '-' for stdin")
+    render.add_argument('-o', '--output', default='-', help="output PDF path, or '-' for stdout")
+    render.add_argument('--template', default=PDF_TEMPLATE)
+    render.set_defaults(func=cmd_render)
+
+    parse = commands.add_parser('parse', help='parse an email body and print the result as JSON')
+    parse.add_argument('file', help="email body file, or '-' for stdin")
+    parse.add_argument('--html', action='store_true', help='the body is HTML')
+    parse.add_argument('--no-roster', action='store_true', help="don't resolve @mentions against the roster")
+    parse.set_defaults(func=cmd_parse)
+
+    backfill = commands.add_parser('backfill', help='process unread emails and unprocessed form rows once')
+    backfill.add_argument('--drive-id', default=drive_id, help='OneDrive drive holding the form workbook')
+    backfill.add_argument('--no-email', action='store_true')
+    backfill.add_argument('--no-forms', action='store_true')
+    backfill.add_argument('--no-refresh', action='store_true', help='use the cached Smartsheet rows as they are')
+    backfill.add_argument('--dry-run', action='store_true', help='list what would be sent')
+    backfill.set_defaults(func=cmd_backfill)
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # No subcommand means `run`, so `python main.py [--profile]` keeps working.
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv = ['run'] + argv
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -1,7 +1,22 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+def _find_dotenv():
+    """The .env load_dotenv() would pick up: the nearest one in or above this package."""
+    path = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(path, '.env')
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+# python-dotenv is only imported when there is a .env to load.
+_DOTENV_PATH = _find_dotenv()
+if _DOTENV_PATH:
+    from dotenv import load_dotenv
+    load_dotenv(_DOTENV_PATH)
 
 CLIENT_ID = os.getenv('CLIENT_ID')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET')
@@ -14,6 +29,73 @@ TENANT_ID = os.getenv('TENANT_ID') or 'common'
 
 # Local files
 SMARTSHEET_CACHE_FILE = os.getenv('SMARTSHEET_CACHE_FILE', 'smartsheet_cache.json')
-PROCESSED_FORM_TRACKER = os.getenv('PROCESSED_FORM_TRACKER', 'processed_form_rows.json')
+SMARTSHEET_CACHE_DB = os.getenv('SMARTSHEET_CACHE_DB', 'smartsheet_cache.db')
+SMARTSHEET_CACHE_BACKEND = os.getenv('SMARTSHEET_CACHE_BACKEND', 'sqlite')
+PROCESSED_FORM_TRACKER = os.getenv('PROCESSED_FORM_TRACKER', 'processed_form_rows.json')  # legacy, migrated to the log
+PROCESSED_FORM_LOG = os.getenv('PROCESSED_FORM_LOG', 'processed_form_rows.log')
+PROCESSED_FORM_COMPACT_SLACK = int(os.getenv('PROCESSED_FORM_COMPACT_SLACK', 1000))
 O365_TOKEN_FILE = os.getenv('O365_TOKEN_FILE', 'o365_token.txt')
 PDF_TEMPLATE = os.getenv('PDF_TEMPLATE', '000000 - Template.pdf')
+PDF_ARCHIVE_DIR = os.getenv('PDF_ARCHIVE_DIR', '')
+INBOX_DELTA_FILE = os.getenv('INBOX_DELTA_FILE', 'inbox_delta.json')
+
+# Smartsheet sync
+SMARTSHEET_API_BASE = os.getenv('SMARTSHEET_API_BASE', 'https://api.smartsheet.com/2.0')
+SMARTSHEET_SYNC_OVERLAP = int(os.getenv('SMARTSHEET_SYNC_OVERLAP', 120))
+SMARTSHEET_RATE_LIMIT = int(os.getenv('SMARTSHEET_RATE_LIMIT', 300))
+SMARTSHEET_MAX_RETRIES = int(os.getenv('SMARTSHEET_MAX_RETRIES', 5))
+# Columns fetched and kept in memory, by lowercased title; '' keeps every column.
+SMARTSHEET_COLUMNS = [c.strip().lower() for c in
+                      os.getenv('SMARTSHEET_COLUMNS', 'ticket number,site,requestor,address,problem').split(',')
+                      if c.strip()]
+
+# Microsoft Graph
+GRAPH_URL = os.getenv('GRAPH_URL', 'https://graph.microsoft.com/v1.0')
+GRAPH_TIMEOUT = (float(os.getenv('GRAPH_CONNECT_TIMEOUT', 5)), float(os.getenv('GRAPH_READ_TIMEOUT', 30)))
+GRAPH_MAX_RETRIES = int(os.getenv('GRAPH_MAX_RETRIES', 5))
+GRAPH_POOL_SIZE = int(os.getenv('GRAPH_POOL_SIZE', 10))
+GRAPH_PAGE_SIZE = int(os.getenv('GRAPH_PAGE_SIZE', 50))
+O365_TOKEN_REFRESH_MARGIN = int(os.getenv('O365_TOKEN_REFRESH_MARGIN', 300))
+GRAPH_BATCH_SIZE = min(int(os.getenv('GRAPH_BATCH_SIZE', 20)), 20)  # Graph caps $batch at 20 requests
+GRAPH_BATCH_MAX_BYTES = int(os.getenv('GRAPH_BATCH_MAX_BYTES', 3 * 1024 * 1024))
+INBOX_USE_DELTA = os.getenv('INBOX_USE_DELTA', '1') == '1'
+INBOX_RECONCILE_INTERVAL = int(os.getenv('INBOX_RECONCILE_INTERVAL', 900))
+
+# Pipeline. Each source polls at its short interval while it has work, backs off by
+# POLL_BACKOFF_FACTOR per idle poll up to its max, and snaps back when any source finds work.
+SMARTSHEET_POLL_INTERVAL = float(os.getenv('SMARTSHEET_POLL_INTERVAL', 30))
+SMARTSHEET_POLL_MAX_INTERVAL = float(os.getenv('SMARTSHEET_POLL_MAX_INTERVAL', 600))
+INBOX_POLL_INTERVAL = float(os.getenv('INBOX_POLL_INTERVAL', 10))
+INBOX_POLL_MAX_INTERVAL = float(os.getenv('INBOX_POLL_MAX_INTERVAL', 300))
+FORM_POLL_INTERVAL = float(os.getenv('FORM_POLL_INTERVAL', 15))
+FORM_POLL_MAX_INTERVAL = float(os.getenv('FORM_POLL_MAX_INTERVAL', 300))
+POLL_BACKOFF_FACTOR = float(os.getenv('POLL_BACKOFF_FACTOR', 2))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 100))
+PIPELINE_RENDER_BATCH = int(os.getenv('PIPELINE_RENDER_BATCH', 20))
+PIPELINE_THREADS = int(os.getenv('PIPELINE_THREADS', 8))
+
+# Metrics: Prometheus text on METRICS_HOST:METRICS_PORT (0 disables) and a periodic JSONL dump ('' disables)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))
+METRICS_DUMP_FILE = os.getenv('METRICS_DUMP_FILE', 'metrics.jsonl')
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 60))
+
+# Profiling (opt-in, or main.py --profile). Every PROFILE_EVERY-th cycle of each name in
+# PROFILE_CYCLES ('' = all; 0 = none) is captured, plus the next cycle after one slower than
+# PROFILE_SLOW_CYCLE seconds. Captures go to PROFILE_DIR as .pstats and allocation reports.
+PROFILE_ENABLED = os.getenv('PROFILE', '').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_EVERY = int(os.getenv('PROFILE_EVERY', 0))
+PROFILE_SLOW_CYCLE = float(os.getenv('PROFILE_SLOW_CYCLE', 60))
+PROFILE_CYCLES = os.getenv('PROFILE_CYCLES', '')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 25))
+
+# PDF rendering
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', 0))  # 0 = one per CPU core
+PDF_POOL_MIN_BATCH = int(os.getenv('PDF_POOL_MIN_BATCH', 8))
+
+# Technician roster used to resolve @mentions
+TECH_ROSTER = os.getenv('TECH_ROSTER', '')
+TECH_ROSTER_FILE = os.getenv('TECH_ROSTER_FILE', 'tech_roster.txt')
+TECH_MATCH_THRESHOLD = float(os.getenv('TECH_MATCH_THRESHOLD', 85))
+TECH_MATCH_MIN_LENGTH = int(os.getenv('TECH_MATCH_MIN_LENGTH', 4))  # shorter mentions must match a name exactly
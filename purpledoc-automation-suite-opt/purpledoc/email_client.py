@@ -1,12 +1,35 @@
-from O365 import Account
-from O365.utils import FileSystemTokenBackend
-from .config import CLIENT_ID, CLIENT_SECRET, TENANT_ID, O365_TOKEN_FILE, SMTP_SERVER, SMTP_PORT
-from typing import List, Optional
+import os, json, time, threading
+from io import BytesIO
+from itertools import islice
+from datetime import datetime, timedelta
+from .config import (CLIENT_ID, TENANT_ID, O365_TOKEN_FILE, SMTP_SERVER, SMTP_PORT,
+                     GRAPH_URL, GRAPH_POOL_SIZE, GRAPH_PAGE_SIZE, O365_TOKEN_REFRESH_MARGIN, GRAPH_MAX_RETRIES,
+                     GRAPH_BATCH_SIZE, GRAPH_BATCH_MAX_BYTES,
+                     INBOX_DELTA_FILE, INBOX_USE_DELTA, INBOX_RECONCILE_INTERVAL)
+from .cache import atomic_write
+from .metrics import MAIL_REQUESTS, instrument_session
+from typing import Iterator, List, Optional, Tuple, Union
+
+# Only the message fields the pipeline reads.
+PD_MESSAGE_FIELDS = ('id', 'subject', 'isRead', 'from', 'sender', 'receivedDateTime', 'body')
+
+def graph_protocol():
+    """MSGraphProtocol pointed at GRAPH_URL, which is Graph itself unless overridden."""
+    from O365 import MSGraphProtocol
+    protocol_url, api_version = GRAPH_URL.rstrip('/').rsplit('/', 1)
+    protocol = MSGraphProtocol(api_version=api_version)
+    protocol.protocol_url = protocol_url + '/'
+    protocol.service_url = f'{protocol.protocol_url}{api_version}/'
+    return protocol
 
 def create_account():
-    credentials = (CLIENT_ID, CLIENT_SECRET)
+    from O365 import Account
+    from O365.utils import FileSystemTokenBackend
+    # The public client flow takes the client id alone; O365 rejects a (id, secret) pair.
+    credentials = (CLIENT_ID,)
     token_backend = FileSystemTokenBackend(token_path='.', token_filename=O365_TOKEN_FILE)
-    account = Account(credentials, auth_flow_type='public', tenant_id=TENANT_ID, token_backend=token_backend)
+    account = Account(credentials, protocol=graph_protocol(), auth_flow_type='public', tenant_id=TENANT_ID,
+                      token_backend=token_backend)
     if not account.is_authenticated:
         account.authenticate(scopes=[
             'offline_access',
@@ -18,22 +41,295 @@ def create_account():
         ])
     return account
 
+# Per-request statuses inside a $batch response that are worth resending.
+BATCH_RETRY_STATUSES = (429, 503, 504)
+
+def _is_unread_pd(m):
+    return bool(m.subject) and m.subject.strip().lower() == 'pd' and not m.is_read
+
+class BatchRequest:
+    """One call queued for a Graph $batch. flush_batch() fills in status and response."""
+
+    def __init__(self, method, url, body=None, msg=None, depends_on=None):
+        self.id = None
+        self.method = method
+        self.url = url
+        self.body = body
+        self.msg = msg
+        self.depends_on = depends_on
+        self.size = len(json.dumps(body)) if body is not None else 0
+        self.status = None
+        self.response = None
+        self.error = None
+        self.retry_after = None
+
+    @property
+    def ok(self):
+        return self.status is not None and 200 <= self.status < 300
+
+    def to_api_data(self, with_dependency=False):
+        data = {'id': self.id, 'method': self.method, 'url': self.url}
+        if self.body is not None:
+            data['body'] = self.body
+            data['headers'] = {'Content-Type': 'application/json'}
+        if with_dependency:
+            data['dependsOn'] = [self.depends_on.id]
+        return data
+
 class EmailClient:
     def __init__(self, account):
         self.account = account
         self.mailbox = account.mailbox()
         self.inbox = self.mailbox.inbox_folder()
+        self._last_reconcile = None
+        self._batch = []
+        self._batch_lock = threading.Lock()
 
-    def fetch_unread_pd_messages(self, limit=10):
-        messages = self.inbox.get_messages(limit=limit)
-        return [m for m in messages if m.subject and m.subject.strip().lower() == 'pd' and not m.is_read]
+    def unread_pd_query(self):
+        return (self.inbox.new_query()
+                .on_attribute('isRead').equals(False)
+                .chain('and').on_attribute('subject').equals('PD')
+                .select(*PD_MESSAGE_FIELDS))
 
-    def send_message(self, to_addr: str, subject: str, body: str, attachments: Optional[List[str]] = None):
+    def fetch_unread_pd_messages(self, limit=None, page_size=GRAPH_PAGE_SIZE) -> Iterator:
+        """Stream unread PD messages, fetching one page of matches at a time."""
+        messages = self.inbox.get_messages(limit=limit, query=self.unread_pd_query(), batch=page_size)
+        # Keep the original exact-match rule as a final check on what the server returns.
+        matches = (m for m in messages if _is_unread_pd(m))
+        return islice(matches, limit) if limit else matches
+
+    def _load_delta_link(self):
+        if not os.path.exists(INBOX_DELTA_FILE):
+            return None
+        try:
+            with open(INBOX_DELTA_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f).get('delta_link')
+        except Exception:
+            return None
+
+    def _save_delta_link(self, delta_link):
+        atomic_write(INBOX_DELTA_FILE, json.dumps({'delta_link': delta_link}))
+
+    def fetch_pd_message_changes(self, page_size=GRAPH_PAGE_SIZE) -> Iterator:
+        """Yield unread PD messages added or changed since the last delta round.
+
+        The delta link is persisted only once the round has been fully consumed,
+        so an interrupted round is replayed on the next call.
+        """
+        from requests import HTTPError
+        delta_link = self._load_delta_link()
+        url = delta_link or self.inbox.build_url(f'/mailFolders/{self.inbox.folder_id}/messages/delta')
+        params = None if delta_link else {'$select': ','.join(PD_MESSAGE_FIELDS)}
+        headers = {'Prefer': f'odata.maxpagesize={page_size}'}
+        connection = self.account.connection
+        while url:
+            try:
+                response = connection.get(url, params=params, headers=dict(headers))
+            except HTTPError as exc:
+                if delta_link and exc.response is not None and exc.response.status_code == 410:
+                    # Delta token expired; start a fresh round.
+                    os.remove(INBOX_DELTA_FILE)
+                    yield from self.fetch_pd_message_changes(page_size)
+                    return
+                raise
+            data = response.json()
+            params = None
+            for item in data.get('value', []):
+                if '@removed' in item:
+                    continue
+                m = self.inbox.message_constructor(parent=self.inbox, **{self.inbox._cloud_data_key: item})
+                if _is_unread_pd(m):
+                    yield m
+            url = data.get('@odata.nextLink')
+            if not url and data.get('@odata.deltaLink'):
+                self._save_delta_link(data['@odata.deltaLink'])
+
+    def poll_pd_messages(self) -> Iterator:
+        """Delta round when enabled, with a periodic full unread query to catch anything left unread."""
+        now = time.monotonic()
+        if not INBOX_USE_DELTA or self._last_reconcile is None or now - self._last_reconcile >= INBOX_RECONCILE_INTERVAL:
+            self._last_reconcile = now
+            if INBOX_USE_DELTA:
+                # Advance the delta link past everything the full query is about to cover.
+                for _ in self.fetch_pd_message_changes():
+                    pass
+            return self.fetch_unread_pd_messages()
+        return self.fetch_pd_message_changes()
+
+    def _new_message(self, to_addr, subject, body, attachments=None):
         m = self.account.new_message()
         m.to.add(to_addr)
         m.subject = subject
         m.body = body
         if attachments:
             for a in attachments:
+                if isinstance(a, tuple):
+                    name, data = a
+                    a = [(BytesIO(data), name)]
                 m.attachments.add(a)
-        m.send()
+        return m
+
+    def send_message(self, to_addr: str, subject: str, body: str,
+                     attachments: Optional[List[Union[str, Tuple[str, bytes]]]] = None):
+        """Attachments are file paths or in-memory (filename, bytes) pairs."""
+        self._new_message(to_addr, subject, body, attachments).send()
+
+    def _relative_url(self, url):
+        # $batch urls are relative to the service root, e.g. /me/sendMail
+        return '/' + url[len(self.account.protocol.service_url):]
+
+    def _enqueue(self, request):
+        with self._batch_lock:
+            self._batch.append(request)
+        return request
+
+    def queue_send(self, to_addr: str, subject: str, body: str,
+                   attachments: Optional[List[Union[str, Tuple[str, bytes]]]] = None, msg=None) -> BatchRequest:
+        """Queue a send for the next $batch. Sends too large to batch go out immediately."""
+        m = self._new_message(to_addr, subject, body, attachments)
+        request = BatchRequest('POST', self._relative_url(m.build_url(m._endpoints.get('send_mail'))),
+                               {'message': m.to_api_data()}, msg=msg)
+        if request.size <= GRAPH_BATCH_MAX_BYTES:
+            return self._enqueue(request)
+        try:
+            request.status = 202 if m.send() else None
+        except Exception as exc:
+            request.error = exc
+        return request
+
+    def queue_mark_read(self, msg, after: Optional[BatchRequest] = None) -> BatchRequest:
+        """Queue marking msg as read. With after=, it only happens if that request succeeds."""
+        url = msg.build_url(msg._endpoints.get('get_message').format(id=msg.object_id))
+        return self._enqueue(BatchRequest('PATCH', self._relative_url(url), {'isRead': True},
+                                          msg=msg, depends_on=after))
+
+    def _batch_chunks(self, requests):
+        """Pack requests into $batch payloads, keeping each request with the one it depends on."""
+        units, unit_of = [], {}
+        for r in requests:
+            if r.depends_on is not None and r.depends_on in unit_of:
+                unit = unit_of[r.depends_on]
+            else:
+                unit = []
+                units.append(unit)
+            unit.append(r)
+            unit_of[r] = unit
+        chunk, size = [], 0
+        for unit in units:
+            unit_size = sum(r.size for r in unit)
+            if chunk and (len(chunk) + len(unit) > GRAPH_BATCH_SIZE or size + unit_size > GRAPH_BATCH_MAX_BYTES):
+                yield chunk
+                chunk, size = [], 0
+            chunk.extend(unit)
+            size += unit_size
+        if chunk:
+            yield chunk
+
+    def _post_batch(self, chunk):
+        for i, r in enumerate(chunk, 1):
+            r.id = str(i)
+        in_chunk = set(chunk)
+        payload = {'requests': [r.to_api_data(r.depends_on in in_chunk) for r in chunk]}
+        try:
+            data = self.account.connection.post(self.account.protocol.service_url + '$batch', data=payload).json()
+        except Exception as exc:
+            for r in chunk:
+                r.error = exc
+            return
+        by_id = {r.id: r for r in chunk}
+        for item in data.get('responses', []):
+            r = by_id.get(str(item.get('id')))
+            if r is None:
+                continue
+            r.status = item.get('status')
+            r.response = item.get('body')
+            r.retry_after = (item.get('headers') or {}).get('Retry-After')
+            if r.method == 'PATCH' and r.ok and r.msg is not None:
+                r.msg.is_read = True
+
+    def flush_batch(self) -> List[BatchRequest]:
+        """Send everything queued through $batch, up to GRAPH_BATCH_SIZE per call.
+
+        Returns the queued requests in order, each carrying its own status and the
+        message it was queued for. Throttled requests are resent after Retry-After.
+        """
+        with self._batch_lock:
+            queued, self._batch = self._batch, []
+        pending = queued
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            ready, in_ready = [], set()
+            for r in pending:
+                parent = r.depends_on
+                # A parent that isn't ok and isn't going out with this round has failed, including
+                # an oversized send that raised (error set, status None).
+                if parent is not None and not parent.ok and parent not in in_ready:
+                    r.status = 424  # the request it depends on failed; Graph's Failed Dependency
+                else:
+                    ready.append(r)
+                    in_ready.add(r)
+            for chunk in self._batch_chunks(ready):
+                self._post_batch(chunk)
+            retry = {r for r in ready if r.status in BATCH_RETRY_STATUSES}
+            # A dependant is only resent alongside its parent.
+            pending = [r for r in ready if r in retry or (r.status == 424 and r.depends_on in retry)]
+            if not pending or attempt == GRAPH_MAX_RETRIES:
+                break
+            delay = max([float(r.retry_after) for r in pending if str(r.retry_after or '').isdigit()] or [2 ** attempt])
+            time.sleep(min(delay, 60))
+        for r in queued:
+            MAIL_REQUESTS.inc(kind='send' if r.method == 'POST' else 'mark_read', outcome='ok' if r.ok else 'failed')
+        return queued
+
+class MailSession:
+    """One authenticated account and EmailClient shared by the whole process."""
+
+    def __init__(self, account=None):
+        self._lock = threading.Lock()
+        self._account = account
+        self._client = None
+
+    @property
+    def account(self):
+        if self._account is None:
+            self._account = create_account()
+            self._pool_connections(self._account.connection)
+        return self._account
+
+    @staticmethod
+    def _pool_connections(connection):
+        if connection.session is None:
+            connection.session = connection.get_session(load_token=True)
+        from requests.adapters import HTTPAdapter
+        retries = connection.session.get_adapter('https://').max_retries
+        adapter = HTTPAdapter(pool_connections=GRAPH_POOL_SIZE, pool_maxsize=GRAPH_POOL_SIZE, max_retries=retries)
+        connection.session.mount('https://', adapter)
+        instrument_session(connection.session, 'graph')
+
+    def ensure_fresh(self):
+        connection = self.account.connection
+        token = connection.token_backend.token
+        if not token or not token.is_long_lived:
+            return
+        margin = timedelta(seconds=O365_TOKEN_REFRESH_MARGIN)
+        if token.access_expiration_datetime - datetime.now() < margin:
+            connection.refresh_token()
+
+    def client(self):
+        with self._lock:
+            self.ensure_fresh()
+            if self._client is None:
+                self._client = EmailClient(self.account)
+            return self._client
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = MailSession()
+        return _session
+
+def get_mail_client():
+    return get_session().client()
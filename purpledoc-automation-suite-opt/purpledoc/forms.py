@@ -1,38 +1,150 @@
-import urllib.parse, json
-from .config import O365_TOKEN_FILE
-import requests
-
-def get_excel_form_rows(drive_id: str, filename="Purple Doc _Online Form.xlsx", worksheet_name="Sheet1"):
-    try:
-        with open(O365_TOKEN_FILE, 'r') as f:
-            token_file = json.load(f)
-        access_token_entry = next(iter(token_file.get('AccessToken', {}).values()))
-        access_token = access_token_entry['secret']
-    except Exception as exc:
-        raise RuntimeError('Failed to read access token') from exc
-
-    headers = {'Authorization': f'Bearer {access_token}'}
-    encoded_filename = urllib.parse.quote(filename)
-    file_metadata_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/root:/{encoded_filename}"
-    res = requests.get(file_metadata_url, headers=headers)
-    res.raise_for_status()
-    file_id = res.json()['id']
-
-    worksheets_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{file_id}/workbook/worksheets"
-    res_ws = requests.get(worksheets_url, headers=headers)
-    res_ws.raise_for_status()
-    worksheets = res_ws.json().get('value', [])
-    ws_names = [ws['name'] for ws in worksheets]
-    ws_name = worksheet_name if worksheet_name in ws_names else (ws_names[0] if ws_names else worksheet_name)
-
-    encoded_ws_name = urllib.parse.quote(ws_name)
-    used_range_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{file_id}/workbook/worksheets('{encoded_ws_name}')/usedRange"
-    res_range = requests.get(used_range_url, headers=headers)
-    res_range.raise_for_status()
-    data = res_range.json()
-    values = data.get('values', [])
-    if not values or len(values) < 2:
-        return []
-
-    headers_row = [str(h).strip().lower() for h in values[0]]
-    return [dict(zip(headers_row, row)) for row in values[1:] if any(row)]
+import urllib.parse, re
+from .graph import get_graph_client
+
+_ADDRESS_RE = re.compile(r"\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?$")
+
+def _parse_address(address):
+    """'Sheet1!A1:K250' -> ('A', 1, 'K', 250)"""
+    m = _ADDRESS_RE.match(address.rsplit('!', 1)[-1])
+    if not m:
+        raise ValueError(f'Unrecognised range address: {address}')
+    first_col, first_row, last_col, last_row = m.groups()
+    return first_col, int(first_row), last_col or first_col, int(last_row or first_row)
+
+class ExcelFormReader:
+    """Reads form rows from a OneDrive workbook, caching the drive item id and worksheet name.
+
+    The cached location is dropped on a 404, and the worksheet name is re-resolved when
+    the file's eTag changes. Polls are incremental: an unchanged eTag skips the workbook
+    entirely, otherwise only rows below the last one read are fetched. Rows stay pending,
+    and are returned on every poll, until they are acknowledged.
+    """
+
+    def __init__(self, drive_id: str, filename="Purple Doc _Online Form.xlsx", worksheet_name="Sheet1", graph=None):
+        self.graph = graph or get_graph_client()
+        self.drive_id = drive_id
+        self.filename = filename
+        self.worksheet_name = worksheet_name
+        self.file_id = None
+        self.ws_name = None
+        self.etag = None
+        self.header = None
+        self.last_row = 0
+        self.pending = {}
+
+    def invalidate(self):
+        self.file_id = None
+        self.ws_name = None
+
+    def note_etag(self, etag):
+        if etag and self.etag and etag != self.etag:
+            self.ws_name = None
+        self.etag = etag or self.etag
+
+    def _resolve_file(self):
+        encoded_filename = urllib.parse.quote(self.filename)
+        file_metadata_url = f"/drives/{self.drive_id}/root:/{encoded_filename}"
+        res = self.graph.get(file_metadata_url)
+        res.raise_for_status()
+        metadata = res.json()
+        self.file_id = metadata['id']
+        self.etag = metadata.get('eTag')
+
+    def _resolve_worksheet(self):
+        worksheets_url = f"/drives/{self.drive_id}/items/{self.file_id}/workbook/worksheets"
+        res_ws = self.graph.get(worksheets_url)
+        res_ws.raise_for_status()
+        worksheets = res_ws.json().get('value', [])
+        ws_names = [ws['name'] for ws in worksheets]
+        self.ws_name = self.worksheet_name if self.worksheet_name in ws_names else (ws_names[0] if ws_names else self.worksheet_name)
+
+    def _resolve(self):
+        self._resolve_file()
+        self._resolve_worksheet()
+
+    def _fetch_etag(self):
+        res = self.graph.get(f"/drives/{self.drive_id}/items/{self.file_id}?$select=eTag")
+        if res.status_code == 404:
+            # The file was replaced: re-resolve it and force a full read.
+            self.invalidate()
+            self._resolve_file()
+            self.header = None
+            return self.etag
+        res.raise_for_status()
+        return res.json().get('eTag')
+
+    def _workbook_get(self, path):
+        if self.file_id is None:
+            self._resolve()
+        elif self.ws_name is None:
+            self._resolve_worksheet()
+        for attempt in range(2):
+            encoded_ws_name = urllib.parse.quote(self.ws_name)
+            url = f"/drives/{self.drive_id}/items/{self.file_id}/workbook/worksheets('{encoded_ws_name}')/{path}"
+            res = self.graph.get(url)
+            if res.status_code == 404 and attempt == 0:
+                # Moved, replaced or renamed since we cached it.
+                self.invalidate()
+                self._resolve()
+                continue
+            res.raise_for_status()
+            return res.json()
+
+    def _add_rows(self, first_row, values):
+        for offset, row in enumerate(values):
+            if any(row):
+                record = dict(zip(self.header, row))
+                record['_row_number'] = first_row + offset
+                self.pending[first_row + offset] = record
+
+    def _read_all(self):
+        data = self._workbook_get('usedRange(valuesOnly=true)')
+        values = data.get('values', [])
+        self.pending = {}
+        if not values:
+            self.header, self.last_row = None, 0
+            return []
+        _, first_row, _, _ = _parse_address(data.get('address', 'A1'))
+        self.header = [str(h).strip().lower() for h in values[0]]
+        self._add_rows(first_row + 1, values[1:])
+        self.last_row = first_row + len(values) - 1
+        return list(self.pending.values())
+
+    def get_rows(self, full=False):
+        """Rows not yet acknowledged. full=True re-reads the whole used range."""
+        if self.file_id is None:
+            self._resolve()
+        elif not full:
+            etag = self._fetch_etag()
+            if etag == self.etag and self.header is not None:
+                return list(self.pending.values())
+            self.note_etag(etag)
+        if full or self.header is None:
+            return self._read_all()
+
+        used = self._workbook_get('usedRange(valuesOnly=true)?$select=address')
+        first_col, _, last_col, last_row = _parse_address(used['address'])
+        if last_row < self.last_row:
+            # Rows were deleted, so row numbers have shifted.
+            return self._read_all()
+        if last_row > self.last_row:
+            address = f"{first_col}{self.last_row + 1}:{last_col}{last_row}"
+            data = self._workbook_get(f"range(address='{address}')")
+            self._add_rows(self.last_row + 1, data.get('values', []))
+            self.last_row = last_row
+        return list(self.pending.values())
+
+    def acknowledge(self, row_numbers):
+        for row_number in row_numbers:
+            self.pending.pop(row_number, None)
+
+_readers = {}
+
+def get_form_reader(drive_id: str, filename="Purple Doc _Online Form.xlsx", worksheet_name="Sheet1"):
+    key = (drive_id, filename, worksheet_name)
+    if key not in _readers:
+        _readers[key] = ExcelFormReader(drive_id, filename, worksheet_name)
+    return _readers[key]
+
+def get_excel_form_rows(drive_id: str, filename="Purple Doc _Online Form.xlsx", worksheet_name="Sheet1", full=False):
+    return get_form_reader(drive_id, filename, worksheet_name).get_rows(full=full)
@@ -0,0 +1,75 @@
+import json, time, threading
+from .config import GRAPH_URL, GRAPH_TIMEOUT, GRAPH_MAX_RETRIES, GRAPH_POOL_SIZE, O365_TOKEN_FILE
+from .metrics import instrument_session
+
+# Treat a token this close to expiry as already expired.
+TOKEN_EXPIRY_SKEW = 60
+
+def read_token_file(path=O365_TOKEN_FILE):
+    """Return (access_token, expires_at) from either the MSAL or the OAuth token cache layout."""
+    try:
+        with open(path, 'r') as f:
+            token_file = json.load(f)
+        if 'AccessToken' in token_file:
+            entry = next(iter(token_file['AccessToken'].values()))
+            return entry['secret'], float(entry.get('expires_on') or 0)
+        return token_file['access_token'], float(token_file.get('expires_at') or 0)
+    except Exception as exc:
+        raise RuntimeError('Failed to read access token') from exc
+
+class GraphClient:
+    """Keep-alive session for raw Graph calls, with timeouts and Retry-After aware retries."""
+
+    def __init__(self, base_url=GRAPH_URL, token_file=O365_TOKEN_FILE, timeout=GRAPH_TIMEOUT,
+                 retries=GRAPH_MAX_RETRIES, pool_size=GRAPH_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.token_file = token_file
+        self.timeout = timeout
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        instrument_session(self.session, 'graph')
+
+    def access_token(self, force=False):
+        with self._lock:
+            if force or self._token is None or time.time() >= self._expires_at - TOKEN_EXPIRY_SKEW:
+                self._token, self._expires_at = read_token_file(self.token_file)
+            return self._token
+
+    def request(self, method, url, **kwargs):
+        if not url.startswith('http'):
+            url = f"{self.base_url}/{url.lstrip('/')}"
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        for force in (False, True):
+            headers['Authorization'] = f'Bearer {self.access_token(force=force)}'
+            res = self.session.request(method, url, headers=headers, **kwargs)
+            if res.status_code != 401:
+                break
+            # Token was revoked or refreshed elsewhere; reload it once from disk.
+        return res
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_graph_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GraphClient()
+        return _client
@@ -0,0 +1,141 @@
+import time
+from .config import PDF_TEMPLATE
+from .email_client import get_mail_client
+from .parser import iter_email_lines, parse_email_body
+from .pdf_util import archive_pdf
+
+def reply_and_mark_read(msg, subject, body):
+    """Queue a reply to msg's sender, and the mark-as-read that only applies once it is sent."""
+    client = get_mail_client()
+    send = client.queue_send(msg.sender.address, subject, body, msg=msg)
+    client.queue_mark_read(msg, after=send)
+
+def parse_email(msg, roster=None):
+    return parse_email_body(iter_email_lines(msg), roster=roster)
+
+def build_email_job(msg, parsed, index):
+    """Report job for a parsed email, or None once an error reply has been queued."""
+    ticket_number = parsed.get('ticket')
+    if parsed.get('error'):
+        # send error email
+        reply_and_mark_read(msg, f'Issue Processing Ticket {ticket_number or ""}', parsed['error'])
+        return
+    if not ticket_number:
+        reply_and_mark_read(msg, 'Issue Processing Ticket', 'No ticket number found in your message.')
+        return
+    row = index.get(ticket_number)
+    if not row:
+        reply_and_mark_read(msg, f'Ticket {ticket_number} Not Found', f'Ticket #{ticket_number} not found in Smartsheet.')
+        return
+
+    sender_name = msg.sender.address.split('@')[0].replace('.', ' ').title()
+    sent_date = msg.received.strftime('%m/%d/%Y')
+    short_date = msg.received.strftime('%m-%d-%y')
+
+    field_map = {
+        'SERVICE TICKET': ticket_number,
+        'COMPANY': row.get('site', ''),
+        'SITE NAME': row.get('site', ''),
+        'REQUESTED BY': row.get('requestor', ''),
+        'SITE ADDRESS': row.get('address', ''),
+        'TICKET REQUESTRow1': row.get('problem', ''),
+        'TECHRow1': sender_name,
+        'TECHNICIAN NOTESRow1': parsed.get('tech_notes',''),
+        'ADDITIONAL NOTESRow1': parsed.get('additional_notes',''),
+        'HOURSRow1': parsed.get('time_spent',''),
+        'DATERow1': sent_date
+    }
+
+    clean_site = (row.get('site') or 'NO_SITE').strip().upper()
+    clean_site = ''.join(ch for ch in clean_site if ch.isalnum() or ch in (' ','-')).replace(' ','_') or 'NO_SITE'
+    pdf_filename = f"{ticket_number} - {clean_site} - {short_date} - PurpleDoc.pdf"
+    return {'to': msg.sender.address, 'ticket': ticket_number, 'filename': pdf_filename, 'field_map': field_map, 'msg': msg}
+
+def prepare_email(msg, index, roster=None):
+    return build_email_job(msg, parse_email(msg, roster), index)
+
+def prepare_form_row(form_row, index):
+    ticket_number = str(form_row.get('ticket number', '')).strip()
+    if not ticket_number:
+        return None
+    email = form_row.get('email', '')
+    name = form_row.get('name', '')
+    work_done = form_row.get('work done', '')
+    hours = str(form_row.get('time spent', '')).strip()
+    status = str(form_row.get('ticket status', '')).strip().lower()
+    completion = form_row.get('completion time', '')
+    try:
+        sent_date = completion.split()[0]
+        short_date = sent_date.replace('/', '-')[2:]
+    except Exception:
+        sent_date = time.strftime('%m/%d/%Y')
+        short_date = time.strftime('%m-%d-%y')
+
+    row = index.get(ticket_number)
+    if not row:
+        return None
+
+    field_map = {
+        'SERVICE TICKET': ticket_number,
+        'COMPANY': row.get('site', ''),
+        'SITE NAME': row.get('site', ''),
+        'REQUESTED BY': row.get('requestor', ''),
+        'SITE ADDRESS': row.get('address', ''),
+        'TICKET REQUESTRow1': row.get('problem', ''),
+        'TECHRow1': name,
+        'TECHNICIAN NOTESRow1': work_done,
+        'ADDITIONAL NOTESRow1': status if status in ['ongoing','close','closed'] else 'ongoing',
+        'HOURSRow1': hours,
+        'DATERow1': sent_date
+    }
+    clean_site = (row.get('site') or 'NO_SITE').strip().upper()
+    clean_site = ''.join(ch for ch in clean_site if ch.isalnum() or ch in (' ','-')).replace(' ','_') or 'NO_SITE'
+    pdf_filename = f"{ticket_number} - {clean_site} - {short_date} - PurpleDoc.pdf"
+    return {'to': email, 'ticket': ticket_number, 'filename': pdf_filename, 'field_map': field_map}
+
+def send_report(job, pdf_bytes):
+    archive_pdf(job['filename'], pdf_bytes)
+    client = get_mail_client()
+    send = client.queue_send(job['to'], f'Purple Doc Report for Ticket #{job["ticket"]}', 'Attached is your Purple Doc form.',
+                             [(job['filename'], pdf_bytes)], msg=job.get('msg'))
+    if job.get('msg'):
+        client.queue_mark_read(job['msg'], after=send)
+    return send
+
+def flush_mail():
+    """Flush queued sends and mark-as-reads through Graph $batch, logging per-message failures."""
+    results = get_mail_client().flush_batch()
+    for r in results:
+        if not r.ok:
+            subject = r.msg.subject if r.msg is not None else r.url
+            print(f'Graph {r.method} {r.url} failed for {subject!r}:', r.status, r.error or r.response)
+    return results
+
+def deliver(rendered):
+    """Queue a send for each (job, pdf_bytes) pair, flush the mail batch, and return the delivered jobs."""
+    sends = []
+    for job, pdf_bytes in rendered:
+        try:
+            sends.append((job, send_report(job, pdf_bytes)))
+        except Exception as e:
+            print(f'Failed to send {job["filename"]}:', e)
+    flushed = set(flush_mail())
+    delivered = []
+    for job, send in sends:
+        if send.ok:
+            delivered.append(job)
+        elif send not in flushed:
+            # Too large to batch and sent on its own.
+            print(f'Failed to send {job["filename"]}:', send.status, send.error or send.response)
+    return delivered
+
+def render_and_send(jobs, render_pool):
+    """Render every job's PDF as one batch, then send. Returns the jobs that were delivered."""
+    rendered = []
+    results = render_pool.render_many([job['field_map'] for job in jobs], PDF_TEMPLATE)
+    for job, (pdf_bytes, error) in zip(jobs, results):
+        if error:
+            print(f'Failed to render {job["filename"]}:', error)
+            continue
+        rendered.append((job, pdf_bytes))
+    return deliver(rendered)
@@ -0,0 +1,231 @@
+import json, time, threading
+from contextlib import contextmanager
+from .config import METRICS_HOST, METRICS_PORT, METRICS_DUMP_FILE, METRICS_DUMP_INTERVAL
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LATENCY_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        with self.lock:
+            return [(f'{self.name}{_fmt_labels(k)}', v) for k, v in self.values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(k), 'value': v} for k, v in self.values.items()]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn=None):
+        super().__init__(name, help)
+        # Optional callable returning (labels, value) pairs, read at scrape time.
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_key(labels)] = value
+
+    def _collect(self):
+        if self.fn is not None:
+            for labels, value in self.fn():
+                self.set(value, **labels)
+
+    def samples(self):
+        self._collect()
+        return super().samples()
+
+    def snapshot(self):
+        self._collect()
+        return super().snapshot()
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, entry in self.values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, entry['counts']):
+                    cumulative += n
+                    out.append((f'{self.name}_bucket{_fmt_labels(key, [("le", bound)])}', cumulative))
+                out.append((f'{self.name}_bucket{_fmt_labels(key, [("le", "+Inf")])}', entry['count']))
+                out.append((f'{self.name}_sum{_fmt_labels(key)}', entry['sum']))
+                out.append((f'{self.name}_count{_fmt_labels(key)}', entry['count']))
+        return out
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(k), 'count': e['count'], 'sum': round(e['sum'], 6),
+                     'buckets': dict(zip(map(str, self.buckets), e['counts']))} for k, e in self.values.items()]
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help, fn=None):
+        gauge = self._get(Gauge, name, help)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {value}' for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in list(self.metrics.items())}
+
+REGISTRY = Registry()
+
+# Hot-path metrics shared across modules.
+STAGE_SECONDS = REGISTRY.histogram('purpledoc_stage_seconds', 'Time spent per pipeline stage call.')
+STAGE_ITEMS = REGISTRY.counter('purpledoc_stage_items_total', 'Items handled per pipeline stage.')
+HTTP_REQUESTS = REGISTRY.counter('purpledoc_http_requests_total', 'HTTP requests by service and status.')
+HTTP_SECONDS = REGISTRY.histogram('purpledoc_http_request_seconds', 'HTTP request latency by service.')
+HTTP_BYTES_SENT = REGISTRY.counter('purpledoc_http_bytes_sent_total', 'Request body bytes by service.')
+HTTP_BYTES_RECEIVED = REGISTRY.counter('purpledoc_http_bytes_received_total', 'Response body bytes by service.')
+MAIL_REQUESTS = REGISTRY.counter('purpledoc_mail_requests_total', 'Batched mail requests by kind and outcome.')
+REPLY_LATENCY = REGISTRY.histogram('purpledoc_reply_latency_seconds',
+                                   'From an email being received to its reply being sent.', LATENCY_BUCKETS)
+ERRORS = REGISTRY.counter('purpledoc_errors_total', 'Errors by where they were caught.')
+
+def stage_timer(stage):
+    return STAGE_SECONDS.time(stage=stage)
+
+def instrument_session(session, service):
+    """Count requests, bytes and latency for every response a requests session receives."""
+    def hook(response, *args, **kwargs):
+        body = response.request.body
+        HTTP_REQUESTS.inc(service=service, status=response.status_code)
+        HTTP_SECONDS.observe(response.elapsed.total_seconds(), service=service)
+        HTTP_BYTES_SENT.inc(len(body) if body else 0, service=service)
+        length = response.headers.get('Content-Length')
+        HTTP_BYTES_RECEIVED.inc(int(length) if length and length.isdigit() else len(response.content), service=service)
+    if getattr(session, '_metrics_service', None) is None:
+        session._metrics_service = service
+        hooks = session.hooks.get('response') or []
+        # Some clients (the Smartsheet SDK) set a bare function rather than a list.
+        session.hooks['response'] = (hooks if isinstance(hooks, list) else [hooks]) + [hook]
+    return session
+
+def serve(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics from a daemon thread. Returns the server, or None if disabled or the port is taken."""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            data = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f'Metrics endpoint disabled, could not bind {host}:{port}:', e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+def dump_jsonl(path=METRICS_DUMP_FILE):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'ts': time.time(), 'metrics': REGISTRY.snapshot()}, separators=(',', ':')) + '\n')
+
+def start_dumper(path=METRICS_DUMP_FILE, interval=METRICS_DUMP_INTERVAL):
+    """Append a snapshot to path every interval seconds from a daemon thread."""
+    if not path or interval <= 0:
+        return None
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                dump_jsonl(path)
+            except Exception as e:
+                print('Failed to dump metrics:', e)
+    thread = threading.Thread(target=run, name='metrics-dump', daemon=True)
+    thread.start()
+    return thread
@@ -1,55 +1,204 @@
-import re
-from collections import defaultdict
-from rapidfuzz import fuzz
+import os, re
+from collections import defaultdict, deque
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, Optional, Union
+from .config import TECH_ROSTER, TECH_ROSTER_FILE, TECH_MATCH_THRESHOLD, TECH_MATCH_MIN_LENGTH
 
 SIGNATURE_PATTERNS = [
     r'^--\s*$', r'^thanks[\s,]*$', r'^regards[\s,]*$',
     r'Get Outlook for iOS', r'Get Outlook for Android', r'Powered by O365',
 ]
 
+# Patterns are compiled once at import; SIGNATURE_RE folds every signature marker into one search.
+SIGNATURE_RE = re.compile('|'.join(f'(?:{pat})' for pat in SIGNATURE_PATTERNS), re.IGNORECASE)
+BR_RE = re.compile(r'(?i)<br\s*/?>')
+SPACES_RE = re.compile(r'[ \t\xa0]+')
+NEWLINE_RE = re.compile(r'\r\n?|\n')
+SIX_DIGITS_RE = re.compile(r'\d{6}')
+TICKET_FALLBACK_RE = re.compile(r'\b\d{6}\b')
+MENTION_RE = re.compile(r'@([A-Za-z\s.]+)')
+TIME_RE = re.compile(r'\btime\s*[:\-]?\s*(\d+(?:\.\d+)?|\d{1,2}:\d{2})', re.IGNORECASE)
+LOOSE_TIME_RE = re.compile(r'^\s*(\d+(?:\.\d+)?|\d{1,2}:\d{2})\s*$')
+
+class _HtmlLineEmitter(HTMLParser):
+    """Turns HTML into cleaned text lines as tags arrive; <br> and block tags end a line."""
+
+    BREAK_START_TAGS = {'br', 'p', 'div', 'li', 'tr', 'table'}
+    BREAK_END_TAGS = {'p', 'div'}
+    SKIP_TAGS = {'style', 'script', 'head'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = deque()
+        self._parts = []
+        self._skip = 0
+
+    def _break(self):
+        line = SPACES_RE.sub(' ', ''.join(self._parts)).strip()
+        self._parts.clear()
+        if line:
+            self.lines.append(line)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BREAK_START_TAGS:
+            self._break()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BREAK_END_TAGS:
+            self._break()
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        pieces = NEWLINE_RE.split(data)
+        self._parts.append(pieces[0])
+        for piece in pieces[1:]:
+            self._break()
+            self._parts.append(piece)
+
+    def finish(self):
+        self.close()
+        self._break()
+
+def iter_html_lines(html: str, chunk_size: int = 8192) -> Iterator[str]:
+    """Yield cleaned, non-empty text lines from HTML, converting one chunk at a time."""
+    parser = _HtmlLineEmitter()
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        while parser.lines:
+            yield parser.lines.popleft()
+    parser.finish()
+    while parser.lines:
+        yield parser.lines.popleft()
+
 def html_to_clean_text(html: str) -> str:
-    html = re.sub(r'(?i)<br\s*/?>', '\n', html)
-    html = re.sub(r'(?i)</p\s*>', '\n', html)
-    html = re.sub(r'(?i)</div\s*>', '\n', html)
-    html = re.sub(r'(?i)<(p|div|li|tr|table)[^>]*>', '\n', html)
-    text = re.sub(r'<[^>]+>', '', html)
-    text = re.sub(r'[ \t]+', ' ', text)
-    text = re.sub(r'\n+', '\n', text)
-    lines = [line.strip() for line in text.split('\n')]
-    return '\n'.join([line for line in lines if line])
-
-def strip_signature(body: str) -> str:
-    lines = body.strip().splitlines()
+    return '\n'.join(iter_html_lines(html))
+
+def _iter_raw_lines(body: Union[str, Iterable[str]]) -> Iterator[str]:
+    if isinstance(body, str):
+        return iter(body.strip().splitlines())
+    return (part for line in body for part in line.splitlines())
+
+def _body_lines(body: Union[str, Iterable[str]]):
+    """Stripped, non-empty lines up to the first signature marker; stops reading there."""
+    lines = []
+    for line in _iter_raw_lines(body):
+        line = line.strip()
+        if SIGNATURE_RE.search(line):
+            break
+        if line:
+            lines.append(line)
+    return lines
+
+def strip_signature(body: Union[str, Iterable[str]]) -> str:
     stripped = []
-    for line in lines:
-        if any(re.search(pat, line.strip(), re.IGNORECASE) for pat in SIGNATURE_PATTERNS):
+    for line in _iter_raw_lines(body):
+        if SIGNATURE_RE.search(line.strip()):
             break
         stripped.append(line)
     return '\n'.join(stripped)
 
-def get_clean_email_body(msg) -> str:
+def _email_body(msg):
     if getattr(msg, 'body', None) and getattr(msg, 'body_type', None):
-        if msg.body_type.lower() == 'html':
-            return html_to_clean_text(msg.body)
-        return msg.body
+        return msg.body, msg.body_type.lower()
     # fallback to raw body (graph)
     if hasattr(msg, '_raw_message') and msg._raw_message:
         body_content = msg._raw_message.get('body', {})
-        content_type = body_content.get('contentType', '').lower()
-        content = body_content.get('content', '')
-        if content_type == 'html':
-            return html_to_clean_text(content)
-        return content
-    return ''
+        return body_content.get('content', ''), body_content.get('contentType', '').lower()
+    return '', ''
+
+def get_clean_email_body(msg) -> str:
+    content, content_type = _email_body(msg)
+    if content_type == 'html':
+        return html_to_clean_text(content)
+    return content
+
+def iter_email_lines(msg) -> Iterator[str]:
+    """Lazily yield a message's body lines, so parsing can stop at the signature."""
+    content, content_type = _email_body(msg)
+    if content_type == 'html':
+        return iter_html_lines(content)
+    return iter(BR_RE.sub('\n', content).splitlines())
 
 def fuzzy_contains(text: str, keywords, threshold=80) -> bool:
-    return any(fuzz.partial_ratio(text.lower(), kw.lower()) >= threshold for kw in keywords)
+    from rapidfuzz import fuzz, process
+    return process.extractOne(text, keywords, scorer=fuzz.partial_ratio, processor=str.lower,
+                              score_cutoff=threshold) is not None
+
+class TechRoster:
+    """Resolves @mentions to known technician names.
 
-def parse_email_body(body: str, default_tech_name='Unknown'):
-    body = re.sub(r'(?i)<br\s*/?>', '\n', body)
-    body = body.replace('\r\n', '\n').replace('\r', '\n')
-    body = strip_signature(body)
-    lines = [line.strip() for line in body.strip().split('\n') if line.strip()]
+    Roster names are preprocessed once; each distinct mention is scored once and cached.
+    Mentions shorter than min_length resolve only to a name or name word they match exactly
+    (and unambiguously), since WRatio scores "Jo" highly against "John Smith".
+    Mentions that match nothing above the threshold are kept verbatim.
+    """
+
+    MAX_CACHE = 10000
+
+    def __init__(self, names: Iterable[str], threshold: float = TECH_MATCH_THRESHOLD,
+                 min_length: int = TECH_MATCH_MIN_LENGTH):
+        from rapidfuzz import utils
+        self.names = list(dict.fromkeys(n.strip() for n in names if n and n.strip()))
+        self._choices = [utils.default_process(n) for n in self.names]
+        self.threshold = threshold
+        self.min_length = min_length
+        # Whole names and single name words -> roster index, None where more than one name has it.
+        self._exact = {}
+        for i, choice in enumerate(self._choices):
+            for key in {choice, *choice.split()}:
+                self._exact[key] = i if self._exact.get(key, i) == i else None
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def resolve(self, mention: str) -> str:
+        cached = self._cache.get(mention)
+        if cached is not None:
+            return cached
+        from rapidfuzz import fuzz, process, utils
+        query = utils.default_process(mention)
+        if len(query) < self.min_length:
+            i = self._exact.get(query)
+            resolved = self.names[i] if i is not None else mention
+        else:
+            match = process.extractOne(query, self._choices, scorer=fuzz.WRatio,
+                                       processor=None, score_cutoff=self.threshold) if self._choices else None
+            resolved = self.names[match[2]] if match else mention
+        if len(self._cache) >= self.MAX_CACHE:
+            self._cache.clear()
+        self._cache[mention] = resolved
+        return resolved
+
+def load_roster(names: str = TECH_ROSTER, path: str = TECH_ROSTER_FILE) -> Optional[TechRoster]:
+    """Roster from the comma-separated TECH_ROSTER and/or TECH_ROSTER_FILE (one name per line)."""
+    roster = [n for n in (names or '').split(',')]
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            roster.extend(f.read().splitlines())
+    roster = TechRoster(roster)
+    return roster if len(roster) else None
+
+def _parse_time(raw):
+    if ':' in raw:
+        h, m = map(int, raw.split(':'))
+        return f"{round(h + m/60.0, 2):.2f}"
+    return f"{float(raw):.2f}"
+
+def parse_email_body(body: Union[str, Iterable[str]], default_tech_name='Unknown', roster: Optional[TechRoster] = None):
+    """Parse a body given as text or as an iterable of lines (e.g. iter_email_lines).
+
+    With a roster, @mentions are resolved to the closest known technician name.
+    """
+    if isinstance(body, str):
+        body = BR_RE.sub('\n', body)
+        body = body.replace('\r\n', '\n').replace('\r', '\n')
+    lines = _body_lines(body)
     flattened = ' '.join(lines).lower()
 
     data = {
@@ -61,57 +210,54 @@ def parse_email_body(body: str, default_tech_name='Unknown'):
         'error': None
     }
 
-    # Ticket number detection (6-digit fallback)
+    # Single pass: ticket line, @mentions, and each tech's notes and time.
+    current_tech = default_tech_name
+    tech_notes = {}
+    tech_times = {}
+    tech_errors = {}
     for line in lines:
-        if 'ticket' in line.lower():
-            m = re.search(r'\d{6}', line)
+        if data['ticket'] is None and 'ticket' in line.lower():
+            m = SIX_DIGITS_RE.search(line)
             if m:
                 data['ticket'] = m.group(0)
-                break
+        if line.startswith('@'):
+            mention_match = MENTION_RE.match(line)
+            if mention_match:
+                current_tech = mention_match.group(1).strip()
+                if roster is not None and current_tech:
+                    current_tech = roster.resolve(current_tech)
+                continue
+        notes = tech_notes.get(current_tech)
+        if notes is None:
+            notes = tech_notes[current_tech] = []
+            tech_times[current_tech] = ''
+        time_match = TIME_RE.search(line) or LOOSE_TIME_RE.match(line)
+        if time_match:
+            raw = time_match.group(1)
+            try:
+                tech_times[current_tech] = _parse_time(raw)
+            except Exception:
+                tech_errors[current_tech] = f"Invalid time format '{raw}' for tech {current_tech}"
+        else:
+            notes.append(line)
+
+    # Ticket number detection (6-digit fallback)
     if not data['ticket']:
-        m = re.search(r'\b\d{6}\b', flattened)
+        m = TICKET_FALLBACK_RE.search(flattened)
         if m:
             data['ticket'] = m.group(0)
 
-    is_closed = 'close' in flattened or 'closed' in flattened
-    is_ongoing = 'ongoing' in flattened
-
-    current_tech = default_tech_name
-    tech_sections = defaultdict(list)
-    for line in lines:
-        mention_match = re.match(r'@([A-Za-z\s.]+)', line)
-        if mention_match:
-            current_tech = mention_match.group(1).strip()
-            continue
-        tech_sections[current_tech].append(line)
-
-    for tech, tech_lines in tech_sections.items():
-        notes = []
-        time_spent = ''
-        for l in tech_lines:
-            time_match = re.search(r'\btime\s*[:\-]?\s*(\d+(?:\.\d+)?|\d{1,2}:\d{2})', l, re.IGNORECASE)
-            if not time_match:
-                loose_time = re.match(r'^\s*(\d+(?:\.\d+)?|\d{1,2}:\d{2})\s*$', l)
-                if loose_time:
-                    time_match = loose_time
-            if time_match:
-                raw = time_match.group(1)
-                try:
-                    if ':' in raw:
-                        h, m = map(int, raw.split(':'))
-                        time_spent = f"{round(h + m/60.0, 2):.2f}"
-                    else:
-                        time_spent = f"{float(raw):.2f}"
-                except Exception:
-                    data['error'] = f"Invalid time format '{raw}' for tech {tech}"
-            else:
-                notes.append(l)
+    for tech, notes in tech_notes.items():
         data['techs'][tech]['notes'] = '\n'.join(notes).strip()
-        data['techs'][tech]['time'] = time_spent
+        data['techs'][tech]['time'] = tech_times[tech]
+        if tech in tech_errors:
+            data['error'] = tech_errors[tech]
 
     if not data['techs']:
         data['techs'][default_tech_name]['notes'] = '\n'.join(lines)
 
+    is_closed = 'close' in flattened or 'closed' in flattened
+    is_ongoing = 'ongoing' in flattened
     if is_closed:
         data['additional_notes'] = 'close'
     elif is_ongoing:
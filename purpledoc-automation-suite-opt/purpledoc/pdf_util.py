@@ -1,19 +1,163 @@
-from pdfrw import PdfReader, PdfWriter, PdfDict, PdfName, PdfString, PdfObject
-from typing import Dict
+import os, threading
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from .config import PDF_TEMPLATE, PDF_ARCHIVE_DIR, PDF_RENDER_WORKERS, PDF_POOL_MIN_BATCH
 
-def fill_pdf(input_pdf_path: str, output_pdf_path: str, data_dict: Dict[str, str]):
-    template_pdf = PdfReader(input_pdf_path)
-    annotations = template_pdf.pages[0].get('/Annots', [])
-    if annotations:
+def _import_pdfrw():
+    """Bind the pdfrw names this module uses. Deferred to the first template load so that
+    importing purpledoc doesn't pay for pdfrw; _clone stays free of per-call imports."""
+    global PdfReader, PdfWriter, PdfDict, PdfArray, PdfName, PdfString, PdfObject
+    from pdfrw import PdfReader, PdfWriter, PdfDict, PdfArray, PdfName, PdfString, PdfObject
+
+def _clone(obj, memo):
+    """Copy the dict/array structure of a parsed PDF; names, strings and stream data are shared."""
+    key = id(obj)
+    if key in memo:
+        return memo[key]
+    if isinstance(obj, PdfDict):
+        new = PdfDict()
+        new.indirect = obj.indirect
+        new._stream = obj.stream
+        memo[key] = new
+        for name, value in obj.iteritems():
+            dict.__setitem__(new, name, _clone(value, memo))
+        return new
+    if isinstance(obj, PdfArray):
+        new = PdfArray()
+        memo[key] = new
+        new.extend(_clone(value, memo) for value in obj)
+        return new
+    return obj
+
+class PdfTemplate:
+    """A form template parsed once, reloaded when the file on disk changes."""
+
+    def __init__(self, path: str):
+        _import_pdfrw()
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._reload_if_changed()
+
+    def _load(self):
+        trailer = PdfReader(self.path)
+        fields = {}
+        annotations = trailer.pages[0]['/Annots'] or []
         for annotation in annotations:
             if annotation['/Subtype'] == '/Widget' and annotation.get('/T'):
-                key = annotation['/T'][1:-1]
-                if key in data_dict:
-                    value = data_dict.get(key) or ''
+                fields.setdefault(annotation['/T'][1:-1], []).append(annotation)
+        # Resolve every indirect object up front so clones never touch the source file.
+        _clone(trailer, {})
+        self._trailer = trailer
+        self._has_annotations = bool(annotations)
+        self.fields = fields
+
+    def _reload_if_changed(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with self._lock:
+            if mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+            return self._trailer, self.fields, self._has_annotations
+
+    def fill(self, data_dict: Dict[str, str]):
+        trailer, fields, has_annotations = self._reload_if_changed()
+        memo = {}
+        filled = _clone(trailer, memo)
+        if not has_annotations:
+            return filled
+        for key, annotations in fields.items():
+            if key in data_dict:
+                value = data_dict.get(key) or ''
+                for annotation in annotations:
+                    annotation = memo[id(annotation)]
                     annotation.update(PdfDict(V=PdfString.encode(value)))
                     annotation.update(PdfDict(AS=PdfName('Yes')))
-        if template_pdf.Root.AcroForm:
-            template_pdf.Root.AcroForm.update(PdfDict(NeedAppearances=PdfObject('true')))
+        if filled.Root.AcroForm:
+            filled.Root.AcroForm.update(PdfDict(NeedAppearances=PdfObject('true')))
         else:
-            template_pdf.Root.update(PdfDict(AcroForm=PdfDict(NeedAppearances=PdfObject('true'))))
-    PdfWriter().write(output_pdf_path, template_pdf)
+            filled.Root.update(PdfDict(AcroForm=PdfDict(NeedAppearances=PdfObject('true'))))
+        return filled
+
+    def write(self, output: Union[str, BinaryIO], data_dict: Dict[str, str]):
+        PdfWriter().write(output, self.fill(data_dict))
+
+    def render(self, data_dict: Dict[str, str]) -> bytes:
+        buffer = BytesIO()
+        self.write(buffer, data_dict)
+        return buffer.getvalue()
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_template(path: str) -> PdfTemplate:
+    with _templates_lock:
+        if path not in _templates:
+            _templates[path] = PdfTemplate(path)
+        return _templates[path]
+
+def fill_pdf(input_pdf_path: str, output: Union[str, BinaryIO], data_dict: Dict[str, str]):
+    get_template(input_pdf_path).write(output, data_dict)
+
+def render_pdf(input_pdf_path: str, data_dict: Dict[str, str]) -> bytes:
+    return get_template(input_pdf_path).render(data_dict)
+
+def archive_pdf(filename: str, pdf_bytes: bytes, archive_dir: str = PDF_ARCHIVE_DIR):
+    """Keep a copy of a sent report for audit. A no-op unless PDF_ARCHIVE_DIR is set."""
+    if not archive_dir:
+        return None
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, filename)
+    with open(path, 'wb') as f:
+        f.write(pdf_bytes)
+    return path
+
+def _render_job(job) -> Tuple[Optional[bytes], Optional[str]]:
+    template_path, data_dict = job
+    try:
+        return render_pdf(template_path, data_dict), None
+    except Exception as exc:
+        return None, f'{type(exc).__name__}: {exc}'
+
+class RenderPool:
+    """Renders batches of field maps on worker processes, each holding its own parsed template.
+
+    Results come back in submission order as (pdf_bytes, error) pairs, so one bad
+    job never takes down the rest of the batch. Batches smaller than min_batch
+    are rendered inline, where process start-up and pickling would cost more than they save.
+    """
+
+    def __init__(self, workers: Optional[int] = None, min_batch: int = PDF_POOL_MIN_BATCH):
+        self.workers = workers or PDF_RENDER_WORKERS or os.cpu_count() or 1
+        self.min_batch = min_batch
+        self._executor = None
+
+    def render_many(self, field_maps: List[Dict[str, str]], template_path: str = PDF_TEMPLATE):
+        jobs = [(template_path, field_map) for field_map in field_maps]
+        if self.workers <= 1 or len(jobs) < self.min_batch:
+            return [_render_job(job) for job in jobs]
+        from concurrent.futures.process import BrokenProcessPool
+        if self._executor is None:
+            self._executor = self._start()
+        chunksize = max(1, len(jobs) // (self.workers * 4))
+        try:
+            return list(self._executor.map(_render_job, jobs, chunksize=chunksize))
+        except BrokenProcessPool as exc:
+            # A worker died (OOM kill, segfault); the pool is unusable. Drop it so the
+            # next batch starts a fresh one, and fail this batch job by job.
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            return [(None, f'BrokenProcessPool: {exc}')] * len(jobs)
+
+    def _start(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # The pool starts lazily from a threaded process; forking it could copy a lock held
+        # by another thread. Workers come from a fork server (spawn where there is none).
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
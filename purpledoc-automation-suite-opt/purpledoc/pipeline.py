@@ -0,0 +1,242 @@
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from .config import (PDF_TEMPLATE, SMARTSHEET_POLL_INTERVAL, SMARTSHEET_POLL_MAX_INTERVAL,
+                     INBOX_POLL_INTERVAL, INBOX_POLL_MAX_INTERVAL, FORM_POLL_INTERVAL, FORM_POLL_MAX_INTERVAL,
+                     POLL_BACKOFF_FACTOR, PIPELINE_QUEUE_SIZE, PIPELINE_RENDER_BATCH, PIPELINE_THREADS, GRAPH_BATCH_SIZE)
+from .email_client import get_mail_client
+from .forms import get_form_reader
+from .jobs import parse_email, build_email_job, prepare_form_row, deliver
+from .profiling import CycleProfiler, run_blocking
+from .metrics import REGISTRY, STAGE_SECONDS, STAGE_ITEMS, REPLY_LATENCY, ERRORS
+
+async def _drain(queue, limit):
+    """Wait for one item, then take whatever else is already queued, up to limit."""
+    items = [await queue.get()]
+    while len(items) < limit and not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+class AdaptivePoller:
+    """A source's poll interval: grows by factor while the source is idle, up to max_interval,
+    and drops back to min_interval as soon as there is work."""
+
+    def __init__(self, poll, min_interval, max_interval, factor=POLL_BACKOFF_FACTOR):
+        self.poll = poll
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.factor = factor
+        self.interval = min_interval
+        self._wake = asyncio.Event()
+
+    def record(self, found):
+        if found:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.factor, self.max_interval)
+
+    def wake(self):
+        """Reset to the short interval and cut the current sleep short."""
+        self.interval = self.min_interval
+        self._wake.set()
+
+    async def sleep(self):
+        try:
+            await asyncio.wait_for(self._wake.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+class Pipeline:
+    """Sources poll on their own cadence and feed bounded queues: parse -> lookup -> render -> send.
+
+    Blocking work (Smartsheet, Graph, PDF rendering) runs in worker threads, so a slow
+    Smartsheet refresh no longer holds up mail replies. An email or form row stays in
+    flight from the poll that found it until its send is flushed, so overlapping polls
+    don't queue it twice. Items that failed before are retried on every poll but don't
+    count as new work, so they don't hold the pollers at their short interval.
+    """
+
+    def __init__(self, sync, cache, render_pool, processed, roster=None, drive_id=None,
+                 queue_size=PIPELINE_QUEUE_SIZE, render_batch=PIPELINE_RENDER_BATCH, profiler=None):
+        self.sync = sync
+        self.cache = cache
+        self.render_pool = render_pool
+        self.processed = processed
+        self.roster = roster
+        self.drive_id = drive_id
+        self.queue_size = queue_size
+        self.render_batch = render_batch
+        self.profiler = profiler or CycleProfiler(enabled=False)
+        self._inflight = set()
+        self._attempted = set()
+
+    def _done(self, item):
+        self._inflight.discard(item['key'])
+
+    async def _claim(self, queue, item):
+        """Queue item unless it is already in flight. True only the first time a key is queued."""
+        key = item['key']
+        if key in self._inflight:
+            return False
+        self._inflight.add(key)
+        new = key not in self._attempted
+        self._attempted.add(key)
+        await queue.put(item)
+        return new
+
+    # Sources. Each returns how many new items it found.
+
+    async def poll_smartsheet(self):
+        with STAGE_SECONDS.time(stage='smartsheet_sync'):
+            changed = await run_blocking(self.sync.refresh)
+        if not changed:
+            return 0
+        await run_blocking(self.sync.save, self.cache)
+        return 1
+
+    async def poll_inbox(self):
+        with STAGE_SECONDS.time(stage='inbox_fetch'):
+            msgs = await run_blocking(lambda: list(get_mail_client().poll_pd_messages()))
+        STAGE_ITEMS.inc(len(msgs), stage='inbox_fetch')
+        found = 0
+        for m in msgs:
+            found += await self._claim(self.parse_q, {'key': ('email', m.object_id), 'msg': m})
+        return found
+
+    async def poll_forms(self):
+        reader = get_form_reader(self.drive_id)
+        with STAGE_SECONDS.time(stage='form_fetch'):
+            rows = await run_blocking(reader.get_rows)
+        STAGE_ITEMS.inc(len(rows), stage='form_fetch')
+        found, done_rows = 0, []
+        for fr in rows:
+            rid = str(fr.get('id', '')).strip()
+            if not rid or rid in self.processed:
+                done_rows.append(fr['_row_number'])
+                continue
+            found += await self._claim(self.lookup_q, {'key': ('form', rid), 'form_id': rid, 'form_row': fr})
+        reader.acknowledge(done_rows)
+        return found
+
+    async def _poll_loop(self, poller):
+        while True:
+            found = 0
+            try:
+                with self.profiler.cycle(poller.poll.__name__):
+                    found = await poller.poll()
+            except Exception as e:
+                print(f'Error in {poller.poll.__name__}:', e)
+                ERRORS.inc(where=poller.poll.__name__)
+            poller.record(found)
+            if found:
+                for other in self.pollers:
+                    if other is not poller:
+                        other.wake()
+            await poller.sleep()
+
+    # Stages.
+
+    async def parse(self, items):
+        for item in items:
+            try:
+                with STAGE_SECONDS.time(stage='parse'):
+                    item['parsed'] = await run_blocking(parse_email, item['msg'], self.roster)
+            except Exception as e:
+                print('Failed to parse message:', e)
+                ERRORS.inc(where='parse')
+                self._done(item)
+                continue
+            await self.lookup_q.put(item)
+
+    async def lookup(self, items):
+        for item in items:
+            index = self.sync.index
+            if 'msg' in item:
+                with STAGE_SECONDS.time(stage='lookup'):
+                    job = await run_blocking(build_email_job, item['msg'], item['parsed'], index)
+                if job is None:
+                    # An error reply was queued; the send stage flushes it.
+                    await self.send_q.put(item)
+                    continue
+            else:
+                with STAGE_SECONDS.time(stage='lookup'):
+                    job = prepare_form_row(item['form_row'], index)
+                if job is None:
+                    self._done(item)
+                    continue
+                job['form_id'] = item['form_id']
+                job['form_row'] = item['form_row']['_row_number']
+            job['key'] = item['key']
+            await self.render_q.put(job)
+
+    async def render(self, jobs):
+        with STAGE_SECONDS.time(stage='render'):
+            results = await run_blocking(self.render_pool.render_many, [job['field_map'] for job in jobs], PDF_TEMPLATE)
+        for job, (pdf_bytes, error) in zip(jobs, results):
+            if error:
+                print(f'Failed to render {job["filename"]}:', error)
+                ERRORS.inc(where='render')
+                self._done(job)
+                continue
+            job['pdf'] = pdf_bytes
+            await self.send_q.put(job)
+
+    async def send(self, items):
+        try:
+            rendered = [(job, job.pop('pdf')) for job in items if 'pdf' in job]
+            with STAGE_SECONDS.time(stage='send'):
+                delivered = await run_blocking(deliver, rendered)
+            now = time.time()
+            for job in delivered:
+                if job.get('msg') is not None and job['msg'].received:
+                    REPLY_LATENCY.observe(now - job['msg'].received.timestamp(), source='email')
+            if self.drive_id:
+                get_form_reader(self.drive_id).acknowledge(job['form_row'] for job in delivered if job.get('form_row'))
+                await run_blocking(self.processed.add_many, [job['form_id'] for job in delivered if job.get('form_id')])
+            delivered_keys = {job['key'] for job in delivered}
+            for item in items:
+                # Delivered reports and error replies won't come back; failures stay attempted.
+                if item['key'] in delivered_keys or 'field_map' not in item:
+                    self._attempted.discard(item['key'])
+        finally:
+            for item in items:
+                self._done(item)
+
+    async def _stage(self, queue, handle, batch=1):
+        while True:
+            items = await _drain(queue, batch)
+            STAGE_ITEMS.inc(len(items), stage=handle.__name__)
+            try:
+                with self.profiler.cycle(handle.__name__):
+                    await handle(items)
+            except Exception as e:
+                print(f'Error in {handle.__name__} stage:', e)
+                ERRORS.inc(where=handle.__name__)
+                for item in items:
+                    self._done(item)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(PIPELINE_THREADS, thread_name_prefix='purpledoc'))
+        self.parse_q = asyncio.Queue(self.queue_size)
+        self.lookup_q = asyncio.Queue(self.queue_size)
+        self.render_q = asyncio.Queue(self.queue_size)
+        self.send_q = asyncio.Queue(self.queue_size)
+        queues = {'parse': self.parse_q, 'lookup': self.lookup_q, 'render': self.render_q, 'send': self.send_q}
+        REGISTRY.gauge('purpledoc_queue_depth', 'Items waiting in each pipeline queue.',
+                       lambda: [({'queue': name}, q.qsize()) for name, q in queues.items()])
+        REGISTRY.gauge('purpledoc_inflight', 'Emails and form rows between poll and send.',
+                       lambda: [({}, len(self._inflight))])
+        self.pollers = [
+            AdaptivePoller(self.poll_smartsheet, SMARTSHEET_POLL_INTERVAL, SMARTSHEET_POLL_MAX_INTERVAL),
+            AdaptivePoller(self.poll_inbox, INBOX_POLL_INTERVAL, INBOX_POLL_MAX_INTERVAL),
+        ]
+        if self.drive_id:
+            self.pollers.append(AdaptivePoller(self.poll_forms, FORM_POLL_INTERVAL, FORM_POLL_MAX_INTERVAL))
+        tasks = [self._poll_loop(poller) for poller in self.pollers] + [
+            self._stage(self.parse_q, self.parse),
+            self._stage(self.lookup_q, self.lookup),
+            self._stage(self.render_q, self.render, self.render_batch),
+            self._stage(self.send_q, self.send, GRAPH_BATCH_SIZE),
+        ]
+        await asyncio.gather(*tasks)
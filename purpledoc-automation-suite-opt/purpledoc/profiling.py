@@ -0,0 +1,147 @@
+import asyncio, contextvars, cProfile, os, pstats, threading, time, tracemalloc
+from contextlib import contextmanager
+from .config import PROFILE_ENABLED, PROFILE_DIR, PROFILE_EVERY, PROFILE_SLOW_CYCLE, PROFILE_CYCLES, PROFILE_TOP
+
+# The capture the current cycle belongs to. asyncio.to_thread copies context into the
+# worker thread, so blocking work run on behalf of a captured cycle is profiled too.
+_capture = contextvars.ContextVar('purpledoc_capture', default=None)
+
+_ALLOC_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+
+class _Capture:
+    def __init__(self, name, reason):
+        self.name = name
+        self.reason = reason
+        self.profiles = []
+        self.unprofiled = 0
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+
+def _profiled_call(fn, *args, **kwargs):
+    capture = _capture.get()
+    if capture is None:
+        return fn(*args, **kwargs)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows one active cProfile per interpreter; while an overlapping
+        # capture holds it, run the work unprofiled rather than not at all.
+        with capture.lock:
+            capture.unprofiled += 1
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.disable()
+        capture.add(profile)
+
+async def run_blocking(fn, *args, **kwargs):
+    """asyncio.to_thread, profiled when the calling cycle is being captured.
+
+    Work handed to other processes (the PDF render pool) is timed but not profiled.
+    """
+    return await asyncio.to_thread(_profiled_call, fn, *args, **kwargs)
+
+class CycleProfiler:
+    """Opt-in cProfile + tracemalloc capture of pipeline cycles.
+
+    A cycle is one source poll or one stage batch. Every `every`-th cycle of each name is
+    captured, and a cycle slower than `slow` seconds arms a capture of that name's next cycle.
+    Each capture writes <dir>/<timestamp>-<name>.pstats and a matching -alloc.txt report.
+    """
+
+    def __init__(self, enabled=PROFILE_ENABLED, out_dir=PROFILE_DIR, every=PROFILE_EVERY,
+                 slow=PROFILE_SLOW_CYCLE, names=PROFILE_CYCLES, top=PROFILE_TOP):
+        self.enabled = enabled
+        self.out_dir = out_dir
+        self.every = every
+        self.slow = slow
+        if isinstance(names, str):
+            names = [n.strip() for n in names.split(',') if n.strip()]
+        # Cycles eligible for periodic capture; empty means all. Slow cycles are always captured.
+        self.names = set(names or ())
+        self.top = top
+        self._counts = {}
+        self._armed = set()
+        self._tracing = 0
+        self._lock = threading.Lock()
+
+    def _reason(self, name):
+        if name in self._armed:
+            self._armed.discard(name)
+            return 'slow'
+        if self.names and name not in self.names:
+            return None
+        count = self._counts[name] = self._counts.get(name, 0) + 1
+        if self.every and count % self.every == 0:
+            return 'periodic'
+        return None
+
+    def arm(self, name):
+        self._armed.add(name)
+
+    @contextmanager
+    def cycle(self, name):
+        if not self.enabled:
+            yield
+            return
+        reason = self._reason(name)
+        capture = before = token = None
+        if reason:
+            capture = _Capture(name, reason)
+            token = _capture.set(capture)
+            before = self._start_tracing()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if capture is not None:
+                _capture.reset(token)
+                after = tracemalloc.take_snapshot()
+                self._stop_tracing()
+                self._write(capture, elapsed, before, after)
+            # A captured cycle runs slower under the profiler, so it doesn't re-arm itself.
+            if capture is None and self.slow and elapsed > self.slow:
+                print(f'Slow {name} cycle: {elapsed:.1f}s; capturing the next one.')
+                self.arm(name)
+
+    def _start_tracing(self):
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            self._tracing += 1
+        return tracemalloc.take_snapshot()
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if self._tracing == 0 and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def _write(self, capture, elapsed, before, after):
+        os.makedirs(self.out_dir, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f'-{int(now * 1000) % 1000:03d}'
+        base = os.path.join(self.out_dir, f'{stamp}-{capture.name}')
+        if capture.profiles:
+            stats = pstats.Stats(*capture.profiles)
+            stats.dump_stats(base + '.pstats')
+        before, after = before.filter_traces(_ALLOC_FILTERS), after.filter_traces(_ALLOC_FILTERS)
+        diff = after.compare_to(before, 'lineno')
+        current = after.statistics('lineno')
+        with open(base + '-alloc.txt', 'w', encoding='utf-8') as f:
+            f.write(f'{capture.name} cycle ({capture.reason}), {elapsed:.3f}s, '
+                    f'{len(capture.profiles)} profiled call(s), {capture.unprofiled} run unprofiled '
+                    f'while another capture held the profiler\n')
+            f.write('Allocations overlapping with other concurrent cycles are included.\n\n')
+            f.write(f'Top {self.top} allocation changes during the cycle:\n')
+            f.writelines(f'  {stat}\n' for stat in diff[:self.top])
+            f.write(f'\nTop {self.top} live allocations at the end of the cycle:\n')
+            f.writelines(f'  {stat}\n' for stat in current[:self.top])
+        print(f'Profiled {capture.name} cycle ({capture.reason}, {elapsed:.2f}s) -> {base}.*')
@@ -0,0 +1,61 @@
+from collections.abc import Mapping
+
+class RowSchema:
+    """Field names shared by every row fetched with the same set of columns."""
+
+    __slots__ = ('fields', 'index')
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+
+    def __len__(self):
+        return len(self.fields)
+
+    def row(self, values):
+        return Row(self, tuple(values))
+
+    def from_dict(self, data):
+        """Project a row dict (e.g. from the cache) onto this schema. Missing fields read as None."""
+        return Row(self, tuple(data.get(name) for name in self.fields))
+
+class Row(Mapping):
+    """A sheet row held as a tuple of cell values, read like a dict keyed by column title.
+
+    Field names live once on the schema instead of once per row. Rows are read-only;
+    a changed sheet row is replaced, not patched.
+    """
+
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, schema, values):
+        self._schema = schema
+        self._values = values
+
+    def __getitem__(self, key):
+        i = self._schema.index.get(key)
+        if i is None:
+            raise KeyError(key)
+        return self._values[i]
+
+    def get(self, key, default=None):
+        i = self._schema.index.get(key)
+        return default if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._schema.index
+
+    def __iter__(self):
+        return iter(self._schema.fields)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __reduce__(self):
+        return Row, (self._schema, self._values)
+
+    def to_dict(self):
+        return dict(zip(self._schema.fields, self._values))
+
+    def __repr__(self):
+        return f'Row({self.to_dict()!r})'
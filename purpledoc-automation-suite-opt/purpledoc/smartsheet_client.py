@@ -1,66 +1,371 @@
-import os, json, time, re
-from .config import SMARTSHEET_TOKEN, SHEET_ID, SMARTSHEET_CACHE_FILE
-import smartsheet
+import time, re, random, threading
+from datetime import datetime, timedelta, timezone
+from .config import (SMARTSHEET_TOKEN, SHEET_ID, SMARTSHEET_API_BASE, SMARTSHEET_SYNC_OVERLAP,
+                     SMARTSHEET_RATE_LIMIT, SMARTSHEET_MAX_RETRIES, SMARTSHEET_COLUMNS)
+from .cache import JsonCache, get_cache
+from .rows import Row, RowSchema
+from .metrics import instrument_session, stage_timer
 
-def fetch_smartsheet_conversations(ss_client, sheet_id, row_ids):
-    conversations = {}
-    for row_id in row_ids:
+class RateLimiter:
+    """Thread-safe token bucket refilled at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# One bucket per process: every call made with SMARTSHEET_TOKEN shares the same quota.
+_limiter = RateLimiter(SMARTSHEET_RATE_LIMIT)
+
+def new_client():
+    import smartsheet
+    client = smartsheet.Smartsheet(SMARTSHEET_TOKEN, api_base=SMARTSHEET_API_BASE)
+    instrument_session(client._session, 'smartsheet')
+    return client
+
+def _call(fn, *args, **kwargs):
+    import smartsheet
+    for attempt in range(SMARTSHEET_MAX_RETRIES + 1):
+        _limiter.acquire()
         try:
-            comments = ss_client.Sheets.list_row_comments(sheet_id, row_id).data
-            conversations[str(row_id)] = [
-                {
-                    "id": c.id,
-                    "text": c.text,
-                    "created_by": getattr(c.created_by, "email", ""),
-                    "created_at": c.created_at.isoformat() if hasattr(c, "created_at") else ""
-                } for c in comments
-            ]
-        except Exception:
-            conversations[str(row_id)] = []
+            result = fn(*args, **kwargs)
+        except smartsheet.exceptions.ApiError as exc:
+            result = exc.error
+        except Exception as exc:
+            result, error, retryable = None, str(exc), True
+        if result is not None:
+            if not isinstance(result, smartsheet.models.Error):
+                return result
+            status = result.result.status_code or 0
+            error = f'{status}: {result.result.message}'
+            retryable = status == 429 or status >= 500
+        if not retryable or attempt == SMARTSHEET_MAX_RETRIES:
+            raise RuntimeError(f'Smartsheet request failed: {error}')
+        time.sleep(min(60, 2 ** attempt) + random.random())
+
+def _comment_dict(c):
+    return {
+        "id": c.id,
+        "text": c.text,
+        "created_by": getattr(c.created_by, "email", ""),
+        "created_at": c.created_at.isoformat() if getattr(c, "created_at", None) else ""
+    }
+
+def fetch_sheet_discussions(ss_client, sheet_id):
+    """Every discussion on the sheet with its comments: one listing instead of a call per row."""
+    return _call(ss_client.Discussions.get_all_discussions, sheet_id, include='comments', include_all=True).data
+
+def row_conversations(discussions):
+    """Comments of the row discussions, keyed by str(row_id). Rows without any are absent."""
+    conversations = {}
+    for d in discussions:
+        if str(d.parent_type).upper() == 'ROW':
+            conversations.setdefault(str(d.parent_id), []).extend(_comment_dict(c) for c in (d.comments or []))
     return conversations
 
-def fetch_smartsheet_data_with_conversations():
-    ss_client = smartsheet.Smartsheet(SMARTSHEET_TOKEN)
-    sheet = ss_client.Sheets.get_sheet(SHEET_ID)
-    columns = [{"id": col.id, "title": col.title.strip().lower()} for col in sheet.columns]
-    rows = []
-    row_ids = []
+def changed_discussion_row_ids(discussions, since):
+    since_dt = datetime.fromisoformat(since)
+    return {
+        d.parent_id for d in discussions
+        if str(d.parent_type).upper() == 'ROW' and d.last_commented_at and d.last_commented_at >= since_dt
+    }
+
+def _project(columns, wanted=SMARTSHEET_COLUMNS):
+    """The wanted columns, in sheet order. No wanted columns means all of them."""
+    if not wanted:
+        return columns
+    return [c for c in columns if c["title"] in wanted]
+
+def _sheet_columns(sheet):
+    return _project([{"id": col.id, "title": col.title.strip().lower()} for col in sheet.columns])
+
+def _column_ids(columns):
+    """column_ids for get_sheet: the projected columns, or None to fetch every column."""
+    return [c["id"] for c in columns] if SMARTSHEET_COLUMNS and columns else None
+
+def resolve_columns(ss_client, sheet_id):
+    """The projected columns, looked up without downloading any rows."""
+    if not SMARTSHEET_COLUMNS:
+        return None
+    data = _call(ss_client.Sheets.get_columns, sheet_id, include_all=True).data
+    columns = _project([{"id": col.id, "title": col.title.strip().lower()} for col in data])
+    missing = set(SMARTSHEET_COLUMNS) - {c["title"] for c in columns}
+    if missing:
+        print('Configured Smartsheet columns not found in the sheet:', sorted(missing))
+    return columns
+
+def row_schema(columns):
+    return RowSchema([c["title"] for c in columns] + ["_row_id"])
+
+def _sheet_rows(sheet, schema):
+    """Compact rows for every row in sheet, reading only the cells of schema's columns."""
+    positions = {col.id: schema.index[col.title.strip().lower()] for col in sheet.columns
+                 if col.title.strip().lower() in schema.index}
+    row_id_pos = schema.index["_row_id"]
     for row in sheet.rows:
-        row_dict = {sheet.columns[i].title.lower(): cell.value for i, cell in enumerate(row.cells)}
-        row_dict["_row_id"] = row.id
-        rows.append(row_dict)
-        row_ids.append(row.id)
-    conversations = fetch_smartsheet_conversations(ss_client, SHEET_ID, row_ids)
+        values = [None] * len(schema)
+        for cell in row.cells:
+            i = positions.get(cell.column_id)
+            if i is not None:
+                values[i] = cell.value
+        values[row_id_pos] = row.id
+        yield Row(schema, tuple(values))
+
+def fetch_smartsheet_data_with_conversations():
+    ss_client = new_client()
+    columns = resolve_columns(ss_client, SHEET_ID)
+    sheet = _call(ss_client.Sheets.get_sheet, SHEET_ID, column_ids=_column_ids(columns))
+    columns = _sheet_columns(sheet)
+    rows = list(_sheet_rows(sheet, row_schema(columns)))
+    found = row_conversations(fetch_sheet_discussions(ss_client, SHEET_ID))
+    conversations = {str(row["_row_id"]): found.get(str(row["_row_id"]), []) for row in rows}
     return columns, rows, conversations
 
+_NON_WORD = re.compile(r'\W+')
+
+def normalize_ticket(ticket_str):
+    if not ticket_str:
+        return ''
+    ticket_str = str(ticket_str).strip().lower()
+    if ticket_str.endswith('.0'):
+        ticket_str = ticket_str[:-2]
+    return _NON_WORD.sub('', ticket_str)
+
+class TicketIndex:
+    """Rows keyed by normalized ticket number, patched row by row as the sheet changes."""
+
+    def __init__(self, rows=()):
+        self._by_ticket = {}
+        self._row_keys = {}
+        for row in rows:
+            self.add(row)
+
+    def __len__(self):
+        return len(self._by_ticket)
+
+    def __contains__(self, ticket_number):
+        return normalize_ticket(ticket_number) in self._by_ticket
+
+    # Lookups run on other threads while a refresh patches the index, so buckets are replaced
+    # rather than mutated and a row is inserted under its new key before leaving its old one.
+
+    def add(self, row):
+        row_id = row.get('_row_id')
+        key = normalize_ticket(row.get('ticket number', ''))
+        old_key = self._row_keys.get(row_id)
+        if key:
+            bucket = {k: v for k, v in self._by_ticket.get(key, {}).items() if k != row_id}
+            bucket[row_id] = row
+            self._by_ticket[key] = bucket
+            self._row_keys[row_id] = key
+        else:
+            self._row_keys.pop(row_id, None)
+        if old_key is not None and old_key != key:
+            self._drop(old_key, row_id)
+        return key or None
+
+    def remove(self, row_id):
+        key = self._row_keys.pop(row_id, None)
+        if key is not None:
+            self._drop(key, row_id)
+
+    def _drop(self, key, row_id):
+        bucket = {k: v for k, v in self._by_ticket[key].items() if k != row_id}
+        if bucket:
+            self._by_ticket[key] = bucket
+        else:
+            del self._by_ticket[key]
+
+    def get(self, ticket_number):
+        bucket = self._by_ticket.get(normalize_ticket(ticket_number))
+        return next(iter(bucket.values())) if bucket else None
+
+    def duplicates(self, keys=None):
+        keys = self._by_ticket.keys() if keys is None else keys
+        return {
+            key: list(self._by_ticket[key].values())
+            for key in keys if len(self._by_ticket.get(key, ())) > 1
+        }
+
+class SmartsheetSync:
+    """Keeps the cached row set current by pulling only rows modified since the last sync."""
+
+    def __init__(self, columns=None, rows=None, conversations=None, version=None, synced_at=None, client=None,
+                 projection=None):
+        self._client = client
+        self.columns = _project(columns or [])
+        self.schema = row_schema(self.columns)
+        self.conversations = conversations or {}
+        self.version = version
+        self.synced_at = synced_at
+        # The SMARTSHEET_COLUMNS the cached rows were fetched with; None for older caches.
+        self.projection = projection
+        self.comment_errors = {}
+        self._pending_comments = set()
+        self._dirty_rows = set()
+        self._dirty_comments = set()
+        self._deleted_rows = set()
+        self._needs_full_save = False
+        if columns and len(self.columns) < len(columns):
+            # Cached before projection: rewrite it with only the projected columns.
+            self._needs_full_save = True
+        if projection is not None:
+            if sorted(projection) != sorted(SMARTSHEET_COLUMNS):
+                # The configured columns changed since the cache was written; the next refresh does a full sync.
+                self.version = None
+        elif SMARTSHEET_COLUMNS and set(SMARTSHEET_COLUMNS) - {c["title"] for c in self.columns}:
+            # An older cache can't tell a newly configured column from one the sheet lacks,
+            # so sync fully once; that records the projection.
+            self.version = None
+        self._rows = {}
+        for row in rows or []:
+            self._rows[row["_row_id"]] = row if isinstance(row, Row) else self.schema.from_dict(row)
+        self.index = TicketIndex(self._rows.values())
+
+    @classmethod
+    def from_cache(cls, cache=None):
+        data = (cache or get_cache()).load()
+        return cls(data.get('columns'), data.get('rows'), data.get('conversations'),
+                   data.get('version'), data.get('synced_at'), projection=data.get('projection'))
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = new_client()
+        return self._client
+
+    @property
+    def rows(self):
+        return list(self._rows.values())
+
+    def _mark_synced(self, started):
+        self.synced_at = (started - timedelta(seconds=SMARTSHEET_SYNC_OVERLAP)).isoformat()
+
+    def save(self, cache):
+        if self._needs_full_save or not cache.supports_upsert:
+            cache.save(self.columns, self.rows, self.conversations, self.version, self.synced_at, self.projection)
+        else:
+            cache.upsert(self.columns,
+                         [self._rows[row_id] for row_id in self._dirty_rows if row_id in self._rows],
+                         {k: self.conversations[k] for k in self._dirty_comments if k in self.conversations},
+                         self._deleted_rows, self.version, self.synced_at, self.projection)
+        self._dirty_rows.clear()
+        self._dirty_comments.clear()
+        self._deleted_rows.clear()
+        self._needs_full_save = False
+
+    def _warn_duplicates(self, keys=None):
+        for key, rows in self.index.duplicates(keys).items():
+            print(f'Duplicate ticket number {key} on rows:', [row["_row_id"] for row in rows])
+
+    def _fetch_comments(self, row_ids, discussions=None):
+        """Set the comments of row_ids from one sheet-wide discussion listing (fetched if not given)."""
+        if discussions is None:
+            try:
+                with stage_timer('comment_fetch'):
+                    discussions = fetch_sheet_discussions(self.client, SHEET_ID)
+            except Exception as exc:
+                # The rows keep their previous comments and are retried on the next refresh.
+                self.comment_errors = {str(row_id): str(exc) for row_id in row_ids}
+                self._pending_comments = set(row_ids)
+                print(f'Failed to fetch comments for {len(row_ids)} row(s):', exc)
+                return
+        found = row_conversations(discussions)
+        for row_id in row_ids:
+            self.conversations[str(row_id)] = found.get(str(row_id), [])
+            self._dirty_comments.add(str(row_id))
+        self.comment_errors = {}
+        self._pending_comments = set()
+
+    def full_sync(self):
+        started = datetime.now(timezone.utc)
+        columns = resolve_columns(self.client, SHEET_ID)
+        sheet = _call(self.client.Sheets.get_sheet, SHEET_ID, column_ids=_column_ids(columns))
+        self.columns = _sheet_columns(sheet)
+        self.schema = row_schema(self.columns)
+        self._rows = {row["_row_id"]: row for row in _sheet_rows(sheet, self.schema)}
+        self.index = TicketIndex(self._rows.values())
+        self._warn_duplicates()
+        self.conversations = {}
+        self._fetch_comments(list(self._rows))
+        self.version = sheet.version
+        self.projection = list(SMARTSHEET_COLUMNS)
+        self._mark_synced(started)
+        self._needs_full_save = True
+        return True
+
+    def refresh(self):
+        if self.version is None or self.synced_at is None or not self._rows:
+            return self.full_sync()
+        started = datetime.now(timezone.utc)
+        changed_ids = []
+        version = _call(self.client.Sheets.get_sheet_version, SHEET_ID).version
+        rows_changed = version != self.version
+        if rows_changed:
+            sheet = _call(self.client.Sheets.get_sheet, SHEET_ID, rows_modified_since=self.synced_at,
+                          column_ids=_column_ids(self.columns))
+            columns = _sheet_columns(sheet)
+            if [c["title"] for c in columns] != [c["title"] for c in self.columns]:
+                return self.full_sync()
+
+            changed_keys = set()
+            for row in _sheet_rows(sheet, self.schema):
+                row_id = row["_row_id"]
+                self._rows[row_id] = row
+                changed_keys.add(self.index.add(row))
+                changed_ids.append(row_id)
+                self._dirty_rows.add(row_id)
+            self._warn_duplicates(changed_keys - {None})
+
+            # Every live row is either cached or was just modified, so any surplus is deletions.
+            if len(self._rows) > (sheet.total_row_count or 0):
+                id_sheet = _call(self.client.Sheets.get_sheet, SHEET_ID, column_ids=[columns[0]["id"]])
+                live_ids = {row.id for row in id_sheet.rows}
+                for row_id in [rid for rid in self._rows if rid not in live_ids]:
+                    del self._rows[row_id]
+                    self.index.remove(row_id)
+                    self.conversations.pop(str(row_id), None)
+                    self._dirty_rows.discard(row_id)
+                    self._dirty_comments.discard(str(row_id))
+                    self._deleted_rows.add(row_id)
+            self.version = sheet.version
+
+        # Comments don't touch row modifiedAt, so discussion activity is tracked separately.
+        # The same listing carries the comments, so changed rows cost no further calls.
+        with stage_timer('comment_fetch'):
+            discussions = fetch_sheet_discussions(self.client, SHEET_ID)
+        comment_ids = set(changed_ids) | self._pending_comments
+        comment_ids |= changed_discussion_row_ids(discussions, self.synced_at)
+        comment_ids &= self._rows.keys()
+        if comment_ids:
+            self._fetch_comments(list(comment_ids), discussions)
+        self._mark_synced(started)
+        return rows_changed or bool(comment_ids)
+
 def load_smartsheet_cache():
-    if os.path.exists(SMARTSHEET_CACHE_FILE):
-        try:
-            with open(SMARTSHEET_CACHE_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('columns', []), data.get('rows', []), data.get('conversations', {}), data.get('timestamp', 0)
-        except Exception:
-            return [], [], {}, 0
-    return [], [], {}, 0
-
-def save_smartsheet_cache(columns, rows, conversations):
-    with open(SMARTSHEET_CACHE_FILE, 'w', encoding='utf-8') as f:
-        json.dump({
-            'columns': columns,
-            'rows': rows,
-            'conversations': conversations,
-            'timestamp': int(time.time())
-        }, f, ensure_ascii=False, indent=2)
+    data = JsonCache().load()
+    return data.get('columns', []), data.get('rows', []), data.get('conversations', {}), data.get('timestamp', 0)
+
+def save_smartsheet_cache(columns, rows, conversations, version=None, synced_at=None):
+    JsonCache().save(columns, rows, conversations, version, synced_at)
 
 def get_ticket_by_number(ticket_number, rows):
-    def normalize_ticket(ticket_str):
-        if not ticket_str:
-            return ''
-        ticket_str = str(ticket_str).strip().lower()
-        if ticket_str.endswith('.0'):
-            ticket_str = ticket_str[:-2]
-        ticket_str = re.sub(r'\W+', '', ticket_str)
-        return ticket_str
+    if isinstance(rows, TicketIndex):
+        return rows.get(ticket_number)
     normalized_target = normalize_ticket(ticket_number)
     for row in rows:
         if normalize_ticket(row.get('ticket number', '')) == normalized_target:
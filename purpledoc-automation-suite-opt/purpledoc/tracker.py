@@ -0,0 +1,89 @@
+import os, json
+from .config import PROCESSED_FORM_LOG, PROCESSED_FORM_TRACKER, PROCESSED_FORM_COMPACT_SLACK
+from .cache import atomic_write
+
+class ProcessedTracker:
+    """Processed form ids, kept in memory and persisted as an append-only log of one id per line.
+
+    Each add is one fsynced append. The log is rewritten only when it carries enough
+    duplicate or torn lines (e.g. from a crash mid-append or a second writer) to be worth it.
+    """
+
+    def __init__(self, path=PROCESSED_FORM_LOG, legacy_path=PROCESSED_FORM_TRACKER,
+                 compact_slack=PROCESSED_FORM_COMPACT_SLACK):
+        self.path = path
+        self.compact_slack = compact_slack
+        self._ids = set()
+        self._lines = 0
+        self._torn = False
+        if os.path.exists(path):
+            self._load()
+        elif legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+        self._f = open(path, 'a', encoding='utf-8')
+        if self._torn:
+            # Appending after a partial line would glue the next id onto it.
+            self.compact()
+        else:
+            self.maybe_compact()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        lines = text.split('\n')
+        if lines[-1]:
+            # Torn final append; it never reached its newline, so it was never acknowledged.
+            self._torn = True
+        for line in lines[:-1]:
+            self._lines += 1
+            if line:
+                self._ids.add(line)
+
+    def _migrate(self, legacy_path):
+        try:
+            with open(legacy_path, 'r') as f:
+                self._ids = {str(i) for i in json.load(f)}
+        except Exception:
+            self._ids = set()
+        self._rewrite()
+
+    def _rewrite(self):
+        atomic_write(self.path, ''.join(f'{i}\n' for i in sorted(self._ids)))
+        self._lines = len(self._ids)
+
+    def __contains__(self, form_id):
+        return str(form_id) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add_many(self, form_ids):
+        """Record form ids as processed. One write and one fsync for the whole call."""
+        new = []
+        for form_id in map(str, form_ids):
+            if form_id and form_id not in self._ids and '\n' not in form_id:
+                self._ids.add(form_id)
+                new.append(form_id)
+        if new:
+            self._f.write(''.join(f'{i}\n' for i in new))
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._lines += len(new)
+            self.maybe_compact()
+        return new
+
+    def add(self, form_id):
+        return bool(self.add_many([form_id]))
+
+    def maybe_compact(self):
+        if self._lines - len(self._ids) >= self.compact_slack:
+            self.compact()
+
+    def compact(self):
+        self._f.close()
+        self._rewrite()
+        self._torn = False
+        self._f = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self._f.close()